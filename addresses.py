@@ -0,0 +1,205 @@
+import functools
+import hashlib
+import re
+from collections import namedtuple
+
+# Candidates must not be part of a longer run of letters and digits
+BTC_BASE58_PATTERN = re.compile('(?<![0-9A-Za-z])[13][a-km-zA-HJ-NP-Z1-9]{25,34}(?![0-9A-Za-z])')
+BTC_BECH32_PATTERN = re.compile('(?<![0-9A-Za-z])(?:bc1[ac-hj-np-z02-9]{8,87}|BC1[AC-HJ-NP-Z02-9]{8,87})(?![0-9A-Za-z])')
+# The 0x prefix is optional, since blacklists quote ETH addresses either way. Without it any hex digest, such as
+# a git commit hash, matches too, so bare candidates are only used for blacklist lookups (see Address.bare)
+ETH_PATTERN = re.compile('(?<![0-9A-Za-z])(?:0x)?[0-9a-fA-F]{40}(?![0-9A-Za-z])')
+ETH_BODY_PATTERN = re.compile('[0-9a-fA-F]{40}')
+CANDIDATE_PATTERNS = (('btc', BTC_BASE58_PATTERN), ('btc', BTC_BECH32_PATTERN), ('eth', ETH_PATTERN))
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BASE58_VALUES = {char: value for value, char in enumerate(BASE58_ALPHABET)}
+BASE58_VERSIONS = (0x00, 0x05) # Mainnet pay-to-pubkey-hash and pay-to-script-hash
+BECH32_CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+BECH32_CONST = 1
+BECH32M_CONST = 0x2bc830a3
+CACHE_SIZE = 4096
+
+# bare is True for ETH addresses that were written without the 0x prefix; value always has it
+Address = namedtuple('Address', ['chain', 'value', 'bare'], defaults=[False])
+
+def valid_base58check(address):
+    '''
+    Given a legacy BTC address, return whether it decodes to a 25-byte mainnet payload with a valid checksum.
+    '''
+    number = 0
+    for char in address:
+        number = number * 58 + BASE58_VALUES[char]
+    leading_zeros = len(address) - len(address.lstrip('1'))
+    body = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    payload = b'\0' * leading_zeros + body
+    if len(payload) != 25 or payload[0] not in BASE58_VERSIONS:
+        return False
+    return hashlib.sha256(hashlib.sha256(payload[:-4]).digest()).digest()[:4] == payload[-4:]
+
+def bech32_polymod(values):
+    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            checksum ^= generator[i] if ((top >> i) & 1) else 0
+    return checksum
+
+def convert_bits(data, from_bits, to_bits):
+    '''
+    Regroup a list of from_bits-wide integers into to_bits-wide integers without padding, or return None.
+    '''
+    accumulator = 0
+    bits = 0
+    result = []
+    for value in data:
+        accumulator = (accumulator << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            result.append((accumulator >> bits) & ((1 << to_bits) - 1))
+    if bits >= from_bits or (accumulator << (to_bits - bits)) & ((1 << to_bits) - 1):
+        return None
+    return result
+
+def valid_bech32(address):
+    '''
+    Given a segwit BTC address, return whether it has a valid Bech32 (version 0) or Bech32m (version 1+) checksum
+    and a well-formed witness program (BIP 173 and BIP 350).
+    '''
+    address = address.lower()
+    if len(address) > 90:
+        return False
+    hrp, data = address[:2], [BECH32_CHARSET.index(char) for char in address[3:]]
+    expanded = [ord(char) >> 5 for char in hrp] + [0] + [ord(char) & 31 for char in hrp]
+    constant = bech32_polymod(expanded + data)
+    if constant not in (BECH32_CONST, BECH32M_CONST) or len(data) < 7:
+        return False
+    version = data[0]
+    program = convert_bits(data[1:-6], 5, 8)
+    if version > 16 or program is None or not 2 <= len(program) <= 40:
+        return False
+    if version == 0:
+        return constant == BECH32_CONST and len(program) in (20, 32)
+    return constant == BECH32M_CONST
+
+KECCAK_ROUND_CONSTANTS = [
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+]
+KECCAK_ROTATIONS = [
+    [0, 36, 3, 41, 18], [1, 44, 10, 45, 2], [62, 6, 43, 15, 61], [28, 55, 25, 21, 56], [27, 20, 39, 8, 14],
+]
+MASK_64 = (1 << 64) - 1
+
+def keccak_f(state):
+    '''
+    Apply the Keccak-f[1600] permutation to a 5x5 list of 64-bit lanes, indexed state[x][y].
+    '''
+    for round_constant in KECCAK_ROUND_CONSTANTS:
+        columns = [state[x][0] ^ state[x][1] ^ state[x][2] ^ state[x][3] ^ state[x][4] for x in range(5)]
+        for x in range(5):
+            rotated = ((columns[(x + 1) % 5] << 1) | (columns[(x + 1) % 5] >> 63)) & MASK_64
+            d = columns[(x - 1) % 5] ^ rotated
+            for y in range(5):
+                state[x][y] ^= d
+        moved = [[0] * 5 for _ in range(5)]
+        for x in range(5):
+            for y in range(5):
+                lane, shift = state[x][y], KECCAK_ROTATIONS[x][y]
+                moved[y][(2 * x + 3 * y) % 5] = ((lane << shift) | (lane >> (64 - shift))) & MASK_64 if shift else lane
+        for x in range(5):
+            for y in range(5):
+                state[x][y] = moved[x][y] ^ (~moved[(x + 1) % 5][y] & moved[(x + 2) % 5][y])
+        state[0][0] ^= round_constant
+
+def keccak256(data):
+    '''
+    Return the Keccak-256 digest used by Ethereum, which pads differently from hashlib's sha3_256.
+    '''
+    rate = 136
+    pad_length = rate - len(data) % rate
+    if pad_length == 1:
+        padded = bytes(data) + b'\x81'
+    else:
+        padded = bytes(data) + b'\x01' + b'\0' * (pad_length - 2) + b'\x80'
+    state = [[0] * 5 for _ in range(5)]
+    for start in range(0, len(padded), rate):
+        block = padded[start:start + rate]
+        for i in range(rate // 8):
+            state[i % 5][i // 5] ^= int.from_bytes(block[8 * i:8 * i + 8], 'little')
+        keccak_f(state)
+    return b''.join(state[i % 5][i // 5].to_bytes(8, 'little') for i in range(4))
+
+def valid_eip55(address):
+    '''
+    Given a 0x-prefixed ETH address, return whether it is all one case or carries a valid EIP-55 checksum.
+    '''
+    body = address[2:]
+    if body == body.lower() or body == body.upper():
+        return True
+    digest = keccak256(body.lower().encode('ascii')).hex()
+    for char, nibble in zip(body, digest):
+        if char.isalpha() and char.isupper() != (int(nibble, 16) >= 8):
+            return False
+    return True
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def is_valid(address):
+    '''
+    Given a candidate found by one of the candidate patterns, return whether its checksum is valid.
+    '''
+    if address.startswith('0x'):
+        return valid_eip55(address)
+    if ETH_BODY_PATTERN.fullmatch(address):
+        return valid_eip55('0x' + address)
+    if address[:3].lower() == 'bc1':
+        return valid_bech32(address)
+    return valid_base58check(address)
+
+def validate_batch(candidates):
+    '''
+    Given an iterable of candidate address strings, return the set of those that are valid. Each distinct
+    candidate is only checked once.
+    '''
+    return {candidate for candidate in set(candidates) if is_valid(candidate)}
+
+def find_candidates(text):
+    '''
+    Given message text, return the address-shaped strings in it, before checksum validation. ETH addresses are
+    always returned with the 0x prefix, and marked bare if they were written without it.
+    '''
+    return [candidate(chain, match.group()) for chain, pattern in CANDIDATE_PATTERNS for match in pattern.finditer(text)]
+
+def candidate(chain, value):
+    if chain == 'eth' and not value.startswith('0x'):
+        return Address(chain, '0x' + value, True)
+    return Address(chain, value)
+
+def signal_addresses(addresses):
+    '''
+    Given extracted addresses, return the ones that count as a sign of a scam on their own. Bare ETH addresses are
+    left out: they are only worth anything when they are blacklisted.
+    '''
+    return [address for address in addresses if not address.bare]
+
+def extract_addresses(text):
+    '''
+    Given message text, return the BTC and ETH addresses in it whose checksums are valid.
+    '''
+    return [address for address in find_candidates(text) if is_valid(address.value)]
+
+def extract_addresses_batch(texts):
+    '''
+    Given a list of message texts, return the list of valid addresses for each, validating every distinct
+    candidate across the whole batch once.
+    '''
+    candidates = [find_candidates(text) for text in texts]
+    valid = validate_batch(address.value for found in candidates for address in found)
+    return [[address for address in found if address.value in valid] for found in candidates]
@@ -0,0 +1,94 @@
+import logging
+
+import discord
+
+logger = logging.getLogger('discord')
+
+class Backfill:
+    '''
+    Scans the history of a channel for messages sent before the bot was running, oldest first. Messages are
+    checked in batches, and each batch's flag counts are written in one update together with a checkpoint of the
+    last message scanned, so an interrupted scan resumes after that message without counting any message twice.
+    Messages the ingest pipeline already counted are skipped: each time the bot starts, the pipeline saves a live
+    checkpoint for each group channel, named after the first message it can count there and pointing at the last
+    message it counted, in the same updates as its counts.
+    '''
+
+    def __init__(self, scan, db, batch_size=100):
+        '''
+        scan is a function given a list of messages that returns, for each one, whether it was flagged. db is the
+        AsyncDatabase the counts and checkpoints are written to.
+        '''
+        self.scan = scan
+        self.db = db
+        self.batch_size = batch_size
+        self.scanned = 0
+        self.flagged = 0
+
+    @staticmethod
+    def checkpoint_name(channel):
+        return f'backfill-{channel.id}'
+
+    @staticmethod
+    def live_checkpoint_name(channel_id, start):
+        '''
+        Return the name of the live checkpoint for the ingest pipeline's run that counts the channel's messages
+        from the snowflake start onwards.
+        '''
+        return f'live-{channel_id}-{start}'
+
+    async def run(self, channel, before=None):
+        '''
+        Scan the channel's history from the saved checkpoint (or the start of the channel) up to before, a
+        snowflake, or the present if None, skipping the ranges covered by live checkpoints. Returns the number of
+        messages scanned and flagged.
+        '''
+        name = self.checkpoint_name(channel)
+        after = await self.db.get_checkpoint(name)
+        prefix = self.live_checkpoint_name(channel.id, '')
+        live = await self.db.get_checkpoints(prefix)
+        covered = [(int(live_name[len(prefix):]), last) for live_name, last in live.items()]
+        scanned, flagged = self.scanned, self.flagged
+        batch = []
+        for start, end in uncovered(after, before, covered):
+            async for message in channel.history(
+                limit=None,
+                after=discord.Object(start) if start is not None else None,
+                before=discord.Object(end) if end is not None else None,
+                oldest_first=True,
+            ):
+                batch.append(message)
+                if len(batch) >= self.batch_size:
+                    await self.commit(name, batch)
+                    batch = []
+        if batch:
+            await self.commit(name, batch)
+        return self.scanned - scanned, self.flagged - flagged
+
+    async def commit(self, name, batch):
+        flags = self.scan(batch)
+        deltas = {message.id: 1 for message, flag in zip(batch, flags) if flag}
+        await self.db.increment_not_severe(deltas, {name: batch[-1].id})
+        self.scanned += len(batch)
+        self.flagged += len(deltas)
+        logger.info(f'Backfill {name}: scanned {self.scanned} messages, flagged {self.flagged}')
+
+
+def uncovered(after, before, covered):
+    '''
+    Given the snowflakes after and before (None for an open end) and a list of (first, last) snowflake ranges,
+    return the (after, before) spans between after and before that no range covers, oldest first. Both ends of
+    each span are exclusive.
+    '''
+    spans = []
+    for first, last in sorted(covered):
+        if before is not None and first >= before:
+            break
+        if after is not None and last <= after:
+            continue
+        if after is None or first > after:
+            spans.append((after, first))
+        after = last if after is None else max(after, last)
+    if after is None or before is None or after < before:
+        spans.append((after, before))
+    return spans
@@ -0,0 +1,343 @@
+'''
+Replays a stream of messages through ModBot's event handlers, using fake Discord objects and an in-memory
+SQLite database, and reports throughput, p50/p99 handler latency and storage calls per event for each phase:
+group channel messages, DM report flows, forwards to the mod channel, moderator reactions and reviewer replies.
+'''
+import argparse
+import asyncio
+import csv
+import itertools
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import discord
+from aiohttp import web
+
+import bot
+from perspective_stub import PerspectiveStub
+
+GUILD_ID = 1000
+GROUP_NUM = '23'
+BENIGN = [
+    'gm everyone, what are you building this week?',
+    'The market is quiet today, holding my positions.',
+    'Just read a great thread about layer 2 scaling.',
+    'Anyone going to the meetup on Friday?',
+    'New blog post on self custody is up, link in bio.',
+]
+SCAM = [
+    'Legit investment manager, send me BTC and I will double it. Contact me on whatsapp',
+    'Send me 0.1 ETH and get double back, limited time only',
+    'Legit account recovery service, message us on whatsapp',
+]
+
+ids = itertools.count(10 ** 17)
+
+class FakeResponse:
+    status = 404
+    reason = 'Not Found'
+
+class FakeMessage:
+    def __init__(self, content, author, channel, reference=None):
+        self.id = next(ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.reference = reference
+        self.created_at = datetime.now(timezone.utc)
+
+    async def reply(self, content):
+        return await self.channel.send(content, reference=self)
+
+    async def edit(self, content=None):
+        await self.channel.rest()
+        self.content = content
+
+    async def delete(self):
+        await self.channel.rest()
+        self.channel.messages.pop(self.id, None)
+
+class FakeChannel:
+    '''
+    Text or DM channel that keeps the messages sent to it. Every REST call waits for latency seconds.
+    '''
+
+    def __init__(self, name, guild, bot_user, latency=0.0):
+        self.id = next(ids)
+        self.name = name
+        self.guild = guild
+        self.bot_user = bot_user
+        self.latency = latency
+        self.messages = {}
+        self.rest_calls = 0
+
+    async def rest(self):
+        self.rest_calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def post(self, content, author):
+        message = FakeMessage(content, author, self)
+        self.messages[message.id] = message
+        return message
+
+    async def send(self, content, reference=None):
+        await self.rest()
+        return self.post(content, self.bot_user)
+
+    async def fetch_message(self, message_id):
+        await self.rest()
+        if message_id not in self.messages:
+            raise discord.NotFound(FakeResponse(), 'Unknown Message')
+        return self.messages[message_id]
+
+    def get_partial_message(self, message_id):
+        return self.messages.get(message_id) or SimpleNamespace(id=message_id, channel=self)
+
+class FakeGuild:
+    def __init__(self):
+        self.id = GUILD_ID
+        self.name = 'Benchmark'
+        self.channels = {}
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+class CountingBackend:
+    '''
+    Wraps a storage backend and counts the calls made to each of its methods.
+    '''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.backend, name)
+        if not callable(attribute):
+            return attribute
+        def counted(*args, **kwargs):
+            with self.lock:
+                self.calls[name] += 1
+            return attribute(*args, **kwargs)
+        return counted
+
+    def total(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+class BenchBot(bot.ModBot):
+    '''
+    ModBot wired to a fake guild instead of a gateway connection.
+    '''
+
+    user = None # Replaces the property backed by the gateway connection
+
+    def __init__(self, latency=0.0):
+        super().__init__('benchmark')
+        self.user = SimpleNamespace(id=next(ids), name=f'Group {GROUP_NUM} Bot')
+        self.group_num = GROUP_NUM
+        self.guild = FakeGuild()
+        self.group_channel = FakeChannel(f'group-{GROUP_NUM}', self.guild, self.user, latency)
+        mod_channel = FakeChannel(f'group-{GROUP_NUM}-mod', self.guild, self.user, latency)
+        for channel in (self.group_channel, mod_channel):
+            self.guild.channels[channel.id] = channel
+        self.guild.text_channels = list(self.guild.channels.values())
+        self.index_guild(self.guild)
+        self.rest_latency = latency
+        self.storage = None
+
+    async def start_benchmark(self):
+        database = await self.db.get_database()
+        self.storage = database.backend = CountingBackend(database.backend)
+        self.pipeline.start()
+
+    def get_guild(self, guild_id):
+        return self.guild if guild_id == GUILD_ID else None
+
+    def get_channel(self, channel_id):
+        return self.guild.get_channel(channel_id)
+
+    def dm_channel(self, user):
+        return FakeChannel(f'dm-{user.id}', None, self.user, self.rest_latency)
+
+class Phase:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.storage_calls = 0
+        self.elapsed = 0.0
+
+    def percentile(self, p):
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+    def row(self):
+        events = len(self.latencies)
+        return (f'{self.name:<14}{events:>8}{events / self.elapsed if self.elapsed else 0:>12.1f}'
+                f'{1000 * self.percentile(0.5):>10.2f}{1000 * self.percentile(0.99):>10.2f}'
+                f'{self.storage_calls / events if events else 0:>10.2f}')
+
+async def timed_phase(client, name, handler, events, drain=None):
+    '''
+    Call handler on each event in turn, recording each call's latency and the storage calls the phase made.
+    drain is awaited at the end of the phase to wait for work the handlers left running in the background.
+    '''
+    phase = Phase(name)
+    calls = client.storage.total()
+    start = time.perf_counter()
+    for event in events:
+        before = time.perf_counter()
+        await handler(event)
+        phase.latencies.append(time.perf_counter() - before)
+    if drain is not None:
+        await drain()
+    phase.elapsed = time.perf_counter() - start
+    phase.storage_calls = client.storage.total() - calls
+    return phase
+
+def load_texts(args):
+    '''
+    Return the channel messages to replay: tweets from the dataset if one is given, otherwise synthetic benign and
+    scam messages, with a fraction of them carrying a blacklisted address.
+    '''
+    rng = random.Random(args.seed)
+    if args.dataset:
+        with open(args.dataset, newline='', encoding='utf-8') as f:
+            texts = [row[args.column] for row in csv.DictReader(f) if row.get(args.column)]
+        texts = [texts[i % len(texts)] for i in range(args.messages)]
+    else:
+        texts = [rng.choice(SCAM if rng.random() < 0.2 else BENIGN) for _ in range(args.messages)]
+    with open('blacklist.txt') as f:
+        addresses = [line.strip() for line, _ in zip(f, range(1000)) if line.strip()]
+    return [f'{text} {rng.choice(addresses)}' if rng.random() < args.blacklisted else text for text in texts]
+
+async def start_perspective_stub(args):
+    '''
+    Serve a PerspectiveStub on a free local port, returning its runner and the URL to point the bot at.
+    '''
+    stub = PerspectiveStub(args.perspective_latency / 1000, args.perspective_error_rate)
+    runner = web.AppRunner(stub.app())
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f'http://{host}:{port}/v1alpha1/comments:analyze'
+
+async def run(args):
+    # The bot's own log is left alone; the benchmark's records go to a file of its own
+    bot.setup_logging(args.log)
+    stub_runner = perspective_url = None
+    if args.perspective_stub:
+        stub_runner, perspective_url = await start_perspective_stub(args)
+    bot.config.update({
+        'storage': 'sqlite',
+        'storage_options': {'path': ':memory:'},
+        'perspective': args.perspective_stub,
+        'perspective_url': perspective_url,
+        # Reports are forwarded when the phase is drained, so the forwards are counted in it
+        'forward_window': 3600.0,
+        'forward_max_delay': 3600.0,
+        'ingest_report_interval': 0,
+        'message_cache_report_every': 0,
+        'write_behind': args.write_behind,
+        'classifier': 'model' if args.model else 'heuristic',
+        'model_path': args.model,
+    })
+    client = BenchBot(args.rest_latency / 1000)
+    await client.start_benchmark()
+    rng = random.Random(args.seed)
+    users = [SimpleNamespace(id=next(ids), name=f'user{i}', bot=False) for i in range(50)]
+    moderator = SimpleNamespace(id=next(ids), name='moderator', bot=False)
+    phases = []
+
+    async def wait_for_pipeline():
+        await client.pipeline.queue.join()
+
+    posted = [client.group_channel.post(text, rng.choice(users)) for text in load_texts(args)]
+    phases.append(await timed_phase(client, 'channel', client.on_message, posted, wait_for_pipeline))
+
+    # Each report is a full DM flow that ends in a forward: scam, finance, misleading url, lost money, nothing else
+    reported = rng.sample(posted, min(args.reports, len(posted)))
+    dms = []
+    for message in reported:
+        reporter = rng.choice(users)
+        channel = client.dm_channel(reporter)
+        link = f'https://discord.com/channels/{GUILD_ID}/{client.group_channel.id}/{message.id}'
+        for step in ['report', link, '2', 'yes', '1', 'yes', 'no', 'block']:
+            dms.append(FakeMessage(step, reporter, channel))
+    phases.append(await timed_phase(client, 'report dm', client.on_message, dms, client.forwarder.flush_all))
+
+    mod_channel = client.mod_channels[GUILD_ID]
+    keys = [(message.channel.id, message.id) for message in reported]
+    phases.append(await timed_phase(client, 'forward', client.fwd_reported, keys))
+
+    forwards = [message.id for message in mod_channel.messages.values() if message.content.startswith('Forwarded message')]
+    reactions = [
+        SimpleNamespace(guild_id=GUILD_ID, channel_id=mod_channel.id, message_id=forward_id,
+                        emoji=SimpleNamespace(name='👍'), member=moderator)
+        for forward_id in forwards
+    ]
+    phases.append(await timed_phase(client, 'reaction', client.on_raw_reaction_add, reactions))
+
+    prompts = [message for message in mod_channel.messages.values() if message.content.startswith('Sufficient public indication')]
+    replies = [
+        FakeMessage('Confirmed scam, wallet drainer link.', moderator, mod_channel,
+                    reference=SimpleNamespace(message_id=prompt.id))
+        for prompt in prompts
+    ]
+    phases.append(await timed_phase(client, 'reviewer reply', client.on_message, replies))
+
+    await client.pipeline.stop()
+    await client.forwarder.flush_all()
+    await client.outbox.close()
+    await client.db.close()
+    if client.perspective is not None:
+        await client.perspective.close()
+        await stub_runner.cleanup()
+    bot.log_listener.stop()
+
+    print(f'{"phase":<14}{"events":>8}{"events/s":>12}{"p50 ms":>10}{"p99 ms":>10}{"db/event":>10}')
+    for phase in phases:
+        print(phase.row())
+    print(f'\nStorage calls: {dict(client.storage.calls)}')
+    pipeline = client.pipeline.stats()
+    print(f'Ingest pipeline: {pipeline}')
+    classifier = pipeline['stages'].get('classifier')
+    if classifier:
+        print(f'Classifier ({type(client.classifier).__name__}): '
+              f'{1000 * classifier["mean_ms"] * classifier["count"] / args.messages:.2f} us/message')
+    if client.perspective is not None:
+        print(f'Perspective: {client.perspective.stats()}')
+    print(f'Outbox: {client.outbox.stats()}')
+    print(f'Message cache: {client.message_cache.stats()}')
+    print(f'Database cache: {client.db.cache_stats()}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the bot's event handlers against fake Discord objects.")
+    parser.add_argument('--dataset', help='CSV of messages to replay, such as twitterdataset.csv (default: synthetic)')
+    parser.add_argument('--column', default='tweet', help='column of the dataset holding the message text')
+    parser.add_argument('--messages', type=int, default=5000, help='number of group channel messages')
+    parser.add_argument('--reports', type=int, default=200, help='number of DM report flows')
+    parser.add_argument('--blacklisted', type=float, default=0.05, help='fraction of messages with a blacklisted address')
+    parser.add_argument('--rest-latency', type=float, default=0.0, help='milliseconds each fake REST call takes')
+    parser.add_argument('--write-behind', action='store_true', help='enable write-behind of non-severe counts')
+    parser.add_argument('--model', help='weights trained by model.py to classify with instead of the heuristic')
+    parser.add_argument('--perspective-stub', action='store_true',
+                        help='score messages with Perspective, served by a local PerspectiveStub')
+    parser.add_argument('--perspective-latency', type=float, default=0.0, help='milliseconds each stub response takes')
+    parser.add_argument('--perspective-error-rate', type=float, default=0.0,
+                        help='fraction of stub requests answered with a 429')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log', default=os.path.join(tempfile.gettempdir(), 'modbot-benchmark.log'),
+                        help='file to write the log to (default: modbot-benchmark.log in the temporary directory)')
+    asyncio.run(run(parser.parse_args()))
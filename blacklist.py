@@ -0,0 +1,65 @@
+import os
+from compact_blacklist import CompactBlacklist
+
+class Blacklist:
+    '''
+    In-memory index of blacklisted crypto addresses, loaded once and reloaded only when the file on disk changes.
+    Paths ending in .bin are opened as memory-mapped compact blacklists (see compact_blacklist.py) instead of
+    being read into memory.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.entries = {} # Map from blacklisted address to its line number in the file (or a CompactBlacklist)
+        self.reload()
+
+    def reload(self):
+        '''
+        Re-read the blacklist file if it has been modified since it was last loaded.
+        '''
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self.mtime:
+            return
+
+        if self.path.endswith('.bin'):
+            previous = self.entries
+            self.entries = CompactBlacklist(self.path)
+            self.mtime = mtime
+            if isinstance(previous, CompactBlacklist):
+                previous.close()
+            return
+
+        entries = {}
+        with open(self.path, "r") as file:
+            for line_number, add in enumerate(file):
+                add = add.strip()
+                if not add or add in entries:
+                    continue
+                entries[add] = line_number
+
+        self.entries = entries
+        self.mtime = mtime
+
+    def find_addresses(self, addresses):
+        '''
+        Given addresses pulled out of a message by addresses.extract_addresses, return the line number of the first
+        one that is blacklisted, or None. ETH addresses are also looked up without the 0x prefix and in lowercase,
+        since blacklists list them either way.
+        '''
+        self.reload()
+        first = None
+        entries = self.entries
+        for address in addresses:
+            keys = [address.value]
+            if address.chain == 'eth':
+                body = address.value[2:]
+                keys += [body, body.lower(), '0x' + body.lower()]
+            for key in keys:
+                line_number = entries.get(key)
+                if line_number is not None and (first is None or line_number < first):
+                    first = line_number
+        return first
@@ -1,43 +1,157 @@
 # bot.py
 import discord
+import asyncio
 from discord.ext import commands
 import os
 import json
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 import re
 from report import Report
-from database import Database
-from unidecode import unidecode 
+from database import AsyncDatabase, Database
+from storage import create_backend
+from message_cache import MessageCache
+from blacklist import Blacklist
+from classifier import ScamClassifier
+from normalize import normalize
+from addresses import extract_addresses, extract_addresses_batch
+from pipeline import IngestPipeline
+from forwarder import ForwardCoalescer
+from outbox import Outbox
+from backfill import Backfill
+from perspective import API_URL, PerspectiveClient
+import metrics
 
-# Set up logging to the console
 logger = logging.getLogger('discord')
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logger.addHandler(handler)
-
-# There should be a file called 'token.json' inside the same folder as this file
-token_path = 'tokens.json'
-if not os.path.isfile(token_path):
-    raise Exception(f"{token_path} not found!")
-with open(token_path) as f:
-    # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
-    tokens = json.load(f)
-    discord_token = tokens['discord']
-    perspective_key = tokens['perspective']
-
-
-class ModBot(discord.Client):
+log_listener = None # Writes log records to the file set up by setup_logging
+
+def setup_logging(path='discord.log'):
+    '''
+    Log to the file at path, replacing its contents. Only called when the bot is run as a script, so importing it
+    (as benchmark.py does) leaves the bot's log alone.
+    '''
+    global log_listener
+    logger.setLevel(logging.DEBUG)
+    handler = logging.FileHandler(filename=path, encoding='utf-8', mode='w')
+    handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
+    # Records are written to the file by a background thread, so logging never blocks the event loop
+    log_listener = QueueListener(queue.SimpleQueue(), handler)
+    logger.addHandler(QueueHandler(log_listener.queue))
+    log_listener.start()
+
+# Optional settings for the bot live in 'config.json'; every setting has a default
+config_path = 'config.json'
+config = {}
+if os.path.isfile(config_path):
+    with open(config_path) as f:
+        config = json.load(f)
+
+# Use the compact binary blacklist if one has been built with compact_blacklist.py
+blacklist_path = 'blacklist.bin' if os.path.isfile('blacklist.bin') else 'blacklist.txt'
+
+
+class ModBot(discord.AutoShardedClient):
     def __init__(self, key):
         intents = discord.Intents.default()
-        super().__init__(command_prefix='.', intents=intents)
+        # Discord picks the number of shards unless shard_count is set
+        super().__init__(command_prefix='.', intents=intents, shard_count=config.get('shard_count'))
         self.group_num = None   
-        self.group_channel = None # Main group channel
+        # Built by index_guild, so handlers route by channel ID instead of comparing channel names
+        self.group_channels = {} # Map from channel ID to each group channel, in every guild
         self.mod_channels = {} # Map from guild to the mod channel id for that guild
+        self.routes = {} # Map from group channel ID to the mod channel its reports are forwarded to
+        self.guild_group_channels = {} # Map from guild ID to the IDs of its group channels
         self.reports = {} # Map from user IDs to the state of their report
+        # Reports idle for longer than this many seconds are dropped by sweep_reports
+        self.report_ttl = config.get('report_ttl', 900)
+        self.report_sweep_interval = config.get('report_sweep_interval', 60)
         self.reported = {} # Map from message IDs to boolean to forward
+        # Only this many of the latest content reviewer reports are included in a forward
+        self.forward_report_limit = config.get('forward_report_limit', 5)
+        # Reports of the same message within this window are forwarded together
+        self.forwarder = ForwardCoalescer(
+            self.fwd_reported,
+            window=config.get('forward_window', 5.0),
+            max_delay=config.get('forward_max_delay', 20.0),
+            ttl=config.get('forward_ttl', 86400.0),
+        )
+        # Everything the bot sends goes through the outbox, which merges replies and retries rate-limited sends
+        self.outbox = Outbox(
+            max_concurrent=config.get('outbox_concurrency', 8),
+            max_retries=config.get('outbox_max_retries', 5),
+        )
+        # Recent group channel messages, so reports and forwards don't have to fetch them again
+        self.message_cache = MessageCache(
+            max_size=config.get('message_cache_size', 1000),
+            report_every=config.get('message_cache_report_every', 1000),
+        )
         self.perspective_key = key
-        self.db = Database()
+        # Perspective API scores are an extra signal next to the classifier, off unless enabled in config.json
+        self.perspective = None
+        if config.get('perspective', False):
+            self.perspective = PerspectiveClient(
+                key,
+                url=config.get('perspective_url', API_URL),
+                thresholds=config.get('perspective_thresholds'),
+                max_concurrent=config.get('perspective_concurrency', 4),
+                batch_size=config.get('perspective_batch_size', 16),
+                batch_window=config.get('perspective_batch_window_ms', 50) / 1000,
+                cache_ttl=config.get('perspective_cache_ttl', 3600.0),
+            )
+        self.backfill_task = None # Task scanning the group channel's history, started with !backfill
+        # Map from group channel ID to the snowflake from which the ingest pipeline counts its messages, set when
+        # the channel is first indexed. Earlier messages are left to the backfill
+        self.live_since = {}
+        self.metrics_runner = None # Serves metrics in the Prometheus format if metrics_port is set
+        # Database calls block on the network, so they run on a thread pool and are awaited. The database is
+        # created on that pool when setup_hook opens it, so initializing Firebase overlaps with connecting
+        self.db = AsyncDatabase(
+            lambda: Database(
+                backend=create_backend(config.get('storage', 'firebase'), **config.get('storage_options', {})),
+                write_behind=config.get('write_behind', False),
+                flush_interval=config.get('write_behind_interval_ms', 500) / 1000,
+                flush_keys=config.get('write_behind_max_keys', 100),
+                cache_size=config.get('db_cache_size', 1024),
+                cache_ttl=config.get('db_cache_ttl', 60.0),
+            ),
+            max_workers=config.get('db_workers', 4),
+            timeout=config.get('db_timeout', 10.0),
+        )
+        self.blacklist = Blacklist(blacklist_path)
+        self.classifier = self.load_classifier()
+        # Used instead of the configured classifier when the ingest queue sheds load
+        self.heuristic = self.classifier if isinstance(self.classifier, ScamClassifier) else ScamClassifier()
+        # Group channel messages are checked by background workers rather than in the gateway event handler
+        self.pipeline = IngestPipeline(
+            self.check_messages,
+            lambda message: self.check_messages([message], self.heuristic, remote=False),
+            workers=config.get('ingest_workers', 4),
+            max_size=config.get('ingest_queue_size', 1000),
+            batch_size=config.get('ingest_batch_size', 16),
+            policy=config.get('ingest_policy', 'block'),
+            report_interval=config.get('ingest_report_interval', 60),
+        )
+
+    async def setup_hook(self):
+        # Without a database every event would fail the same way, so the bot shuts down instead
+        self.db.open(on_failure=lambda error: asyncio.create_task(self.close()))
+        self.pipeline.start()
+        asyncio.create_task(self.sweep_reports())
+        if 'metrics_port' in config:
+            self.metrics_runner = await metrics.REGISTRY.serve(config.get('metrics_host', '127.0.0.1'), config['metrics_port'])
+        if 'metrics_file' in config:
+            asyncio.create_task(metrics.REGISTRY.write_periodically(config['metrics_file'], config.get('metrics_interval', 15.0)))
+
+    async def sweep_reports(self):
+        '''
+        Periodically remove reports whose users stopped responding, so abandoned reports don't pile up.
+        '''
+        while not self.is_closed():
+            await asyncio.sleep(self.report_sweep_interval)
+            for author_id, report in list(self.reports.items()):
+                if report.idle_time() > self.report_ttl:
+                    self.reports.pop(author_id, None)
 
     async def on_ready(self):
 
@@ -46,67 +160,143 @@ class ModBot(discord.Client):
             print(f' - {guild.name}')
         print('Press Ctrl-C to quit.')
 
+        # Guilds are normally indexed as they become available; this catches any that weren't
+        if self.group_num is None:
+            self.find_group_num()
+        for guild in self.guilds:
+            if guild.id not in self.guild_group_channels:
+                self.index_guild(guild)
+
+    async def on_guild_available(self, guild):
+        # Index each guild as soon as it is available, so its group channel messages are handled from then on
+        # rather than only once every shard is ready
+        if self.group_num is None:
+            self.find_group_num()
+        self.index_guild(guild)
+
+    def find_group_num(self):
         # Parse the group number out of the bot's name
         match = re.search('[gG]roup (\d+) [bB]ot', self.user.name)
         if match:
             self.group_num = match.group(1)
         else:
             raise Exception("Group number not found in bot's name. Name format should be \"Group # Bot\".")
-        
-        # Find the mod channel in each guild that this bot should report to
-        for guild in self.guilds:
-            for channel in guild.text_channels:
-                if channel.name == f'group-{self.group_num}':
-                    self.group_channel = channel
-                if channel.name == f'group-{self.group_num}-mod':
-                    self.mod_channels[guild.id] = channel
+
+    def index_guild(self, guild):
+        '''
+        Find the guild's group channels and mod channel, and route reports of messages in its group channels to
+        its mod channel. Called once per guild, and again when the guild's channels change.
+        '''
+        self.unindex_guild(guild.id)
+        group_channels = []
+        for channel in guild.text_channels:
+            if channel.name == f'group-{self.group_num}':
+                group_channels.append(channel)
+            if channel.name == f'group-{self.group_num}-mod':
+                self.mod_channels[guild.id] = channel
+        self.guild_group_channels[guild.id] = [channel.id for channel in group_channels]
+        for channel in group_channels:
+            self.group_channels[channel.id] = channel
+            self.live_since.setdefault(channel.id, discord.utils.time_snowflake(discord.utils.utcnow()))
+            if guild.id in self.mod_channels:
+                self.routes[channel.id] = self.mod_channels[guild.id]
+
+    def unindex_guild(self, guild_id):
+        self.mod_channels.pop(guild_id, None)
+        for channel_id in self.guild_group_channels.pop(guild_id, []):
+            self.group_channels.pop(channel_id, None)
+            self.routes.pop(channel_id, None)
+
+    async def on_guild_join(self, guild):
+        if self.group_num is not None:
+            self.index_guild(guild)
+
+    async def on_guild_remove(self, guild):
+        self.unindex_guild(guild.id)
+
+    async def on_guild_channel_create(self, channel):
+        if self.group_num is not None:
+            self.index_guild(channel.guild)
+
+    async def on_guild_channel_delete(self, channel):
+        if self.group_num is not None:
+            self.index_guild(channel.guild)
+
+    async def on_guild_channel_update(self, before, after):
+        if self.group_num is not None and before.name != after.name:
+            self.index_guild(after.guild)
+
+    async def close(self):
+        # Finish with queued messages and replies, then write out any counter increments still held by the write-behind buffer
+        if self.backfill_task is not None:
+            # The backfill resumes from its checkpoint next time
+            self.backfill_task.cancel()
+        await self.pipeline.stop()
+        await self.forwarder.flush_all()
+        await self.outbox.close()
+        if self.perspective is not None:
+            await self.perspective.close()
+        await self.db.close()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        await super().close()
+        if log_listener is not None:
+            log_listener.stop()
 
     async def on_raw_reaction_add(self, payload):
         '''
         This function is called whenever a user reacts to a message in a channel that the bot can see.
         Currently the bot is configured to send a message describing the action taken to the "group-#-mod" channel.
         '''
-        if payload.guild_id not in self.mod_channels:
-            return
-        if payload.channel_id != self.mod_channels[payload.guild_id].id:
-            return
-        mod_channel = self.mod_channels[payload.guild_id]
-        message = await mod_channel.fetch_message(payload.message_id)
-        
-        # Make sure it's a report forwarded by the bot
-        if message.reference is not None or message.author.id != self.user.id:
+        mod_channel = self.mod_channels.get(payload.guild_id)
+        if mod_channel is None or payload.channel_id != mod_channel.id:
             return
 
-        # Get message ID from forwarded report content
-        original_message_ID = int(message.content.split(' ')[4])
+        # Make sure it's a report forwarded by the bot, and look up the message it forwarded
+        forward = await self.db.get_forward(payload.message_id)
+        if forward is None:
+            forward = await self.parse_forward(mod_channel, payload.message_id)
+            if forward is None:
+                return
+        original_message_ID, original_channel_ID = forward
+        # Only used to reply to, so there is no need to fetch it
+        message = mod_channel.get_partial_message(payload.message_id)
+
         original_message = None
         try:
-            original_message = await self.group_channel.fetch_message(original_message_ID)
+            original_message = await self.message_cache.fetch(self.get_channel(original_channel_ID), original_message_ID)
         except:
             return
 
+        if payload.emoji.name in ('👍', '👎', '❌'):
+            # A moderator has acted on this forward, so new reports of the message get a new forward
+            self.forwarder.close((original_channel_ID, original_message_ID))
+
         if payload.emoji.name == '👍':
             r = (f"Sufficient public indication that Tweet is a scam according to {payload.member.name}. "
             "Applying warning to Tweet. "
             "Please reply to this message with a content reviewer report. "
             )
-            prompt = await message.reply(r)
+            # The prompt's ID is recorded, so it is sent on its own
+            prompt = await self.outbox.send(mod_channel, r, reference=message, merge=False)
             # Marks as requiring content review report
-            self.db.add_prompt(prompt.id, original_message_ID)
-            await original_message.reply('Warning: Tweet has been confirmed to be a scam by the content moderation team.')
+            await self.db.add_prompt(prompt.id, original_message_ID)
+            self.outbox.reply(original_message, 'Warning: Tweet has been confirmed to be a scam by the content moderation team.')
         elif payload.emoji.name == '👎':
             r = (f"Insufficient public indication that Tweet is a scam according to {payload.member.name}. "
             "Applying warning to Tweet. "
             )
-            await message.reply(r)
-            self.db.add_not_severe(original_message_ID)
-            await original_message.reply('Warning: Tweet has been reported by users as a scam.')
+            self.outbox.reply(message, r)
+            await self.db.add_not_severe(original_message_ID)
+            self.outbox.reply(original_message, 'Warning: Tweet has been reported by users as a scam.')
         elif payload.emoji.name == '❌':
-            await original_message.delete()
+            with metrics.timed('discord_rest_seconds', call='delete'):
+                await original_message.delete()
+            self.message_cache.evict(original_message_ID)
             r = (f"Previous content reviewer reports suggest Tweet should be deleted according to {payload.member.name}. "
             "Deleting Tweet."
             )
-            await message.reply(r)
+            self.outbox.reply(message, r)
     
     async def on_message(self, message):
         '''
@@ -129,34 +319,50 @@ class ModBot(discord.Client):
         The bot is configured to check if a cryptoaddress has been edited, and whether or not the new message contains a
         blacklisted crypto address.
         """
-        with open("blacklist.txt", "r") as file:
-            addresses = file.readlines()
-            for add in addresses:
-                add = add.strip()
-                if add in after.content:
-                    r = "Message has been edited to contain fraudulent or suspicious crypto addresses. "
-                    await after.reply(r)
-                    break
-                elif add in before.content:
-                    r = "Message previously containing fraudulent/suspicious crypto addresses have been edited to contain a new crypto address."
-                    await after.reply(r)
-                    break
-            file.close()
+        if after.channel.id in self.group_channels:
+            self.message_cache.put(after)
+
+        # Whichever blacklisted address comes first in the file decides the reply
+        with metrics.timed('edit_check_seconds', help='Time taken to check edited messages against the blacklist'):
+            after_match = self.blacklist.find_addresses(extract_addresses(normalize(after.content)))
+            before_match = self.blacklist.find_addresses(extract_addresses(normalize(before.content)))
+        if after_match is not None and (before_match is None or after_match <= before_match):
+            r = "Message has been edited to contain fraudulent or suspicious crypto addresses. "
+            self.outbox.reply(after, r)
+        elif before_match is not None:
+            r = "Message previously containing fraudulent/suspicious crypto addresses have been edited to contain a new crypto address."
+            self.outbox.reply(after, r)
     
-    async def fwd_reported(self, message_id):
-        message = await self.group_channel.fetch_message(message_id)
-        # Forward the message to the mod channel
-        mod_channel = self.mod_channels[message.guild.id]
+    async def on_raw_message_delete(self, payload):
+        self.message_cache.evict(payload.message_id)
+
+    async def on_raw_bulk_message_delete(self, payload):
+        for message_id in payload.message_ids:
+            self.message_cache.evict(message_id)
+
+    async def fwd_reported(self, message_key, reporter_count=1, forward_id=None):
+        '''
+        Given (channel ID, message ID) of a reported message, forward it to the mod channel its channel is routed
+        to, or if forward_id is given, update that existing forward. Called by self.forwarder once reports of the
+        message stop coming in. Returns the ID of the forward.
+        '''
+        channel_id, message_id = message_key
+        message = await self.message_cache.fetch(self.get_channel(channel_id), message_id)
+        # Forward the message to the mod channel; messages outside the group channels go to their guild's
+        mod_channel = self.routes.get(channel_id) or self.mod_channels[message.guild.id]
 
         fwd = f'Forwarded message with ID {message.id} \n{message.author.name}: "{message.content}"'
+        fwd += f'\n\nReported by {reporter_count} user{"" if reporter_count == 1 else "s"}.'
 
         fwd += '\n\nPrevious content reviewer reports include the following: '
-        message_info = self.db.get_cr_reports(message.id)
-        if message_info == None:
+        message_info = await self.db.get_cr_reports(message.id, self.forward_report_limit)
+        if message_info == None or not message_info['cr_reports']:
             fwd += '\nNo reports found.'
         else:
-            for i in range(1, message_info['cr_report_count'] + 1):
-                report = message_info['cr_reports'][i]
+            total = message_info['cr_report_count']
+            if total > len(message_info['cr_reports']):
+                fwd += f'\n(Showing the latest {len(message_info["cr_reports"])} of {total} reports.)'
+            for report in message_info['cr_reports']:
                 author = report['author']
                 desc = report['description']
                 time = report['time']
@@ -165,7 +371,35 @@ class ModBot(discord.Client):
         fwd += ' In this case, you will be asked to submit a content reviewer report.'
         fwd += ' Otherwise, react with 👎.'
         fwd += ' If prior reviews indicate the original message should be deleted, react with ❌.'
-        await mod_channel.send(fwd)
+        if forward_id is not None:
+            with metrics.timed('discord_rest_seconds', call='edit'):
+                await mod_channel.get_partial_message(forward_id).edit(content=fwd)
+            return forward_id
+        # Forwards are looked up by ID when moderators react, so each is sent on its own
+        forwarded = await self.outbox.send(mod_channel, fwd, merge=False)
+        # Remember which message this forwards, so reactions to it can be handled without parsing or fetching it.
+        # The database caches it, so reactions to recent forwards don't read it back
+        await self.db.add_forward(forwarded.id, message.id, message.channel.id)
+        return forwarded.id
+
+    async def parse_forward(self, mod_channel, forward_id):
+        '''
+        Find the original message of a forward posted before forwards were recorded in the database by parsing
+        its text, and record it. Returns (message ID, channel ID), or None if the message is not a forward.
+        '''
+        try:
+            message = await mod_channel.fetch_message(forward_id)
+        except discord.HTTPException:
+            return None
+        if message.reference is not None or message.author.id != self.user.id or not message.content.startswith('Forwarded message with ID '):
+            return None
+        # Those forwards all came from the group channel that reports to this mod channel
+        channel_ids = [channel_id for channel_id, routed in self.routes.items() if routed.id == mod_channel.id]
+        if not channel_ids:
+            return None
+        forward = (int(message.content.split(' ')[4]), channel_ids[0])
+        await self.db.add_forward(forward_id, *forward)
+        return forward
 
     async def handle_dm(self, message):
         # Handle a help message
@@ -173,7 +407,7 @@ class ModBot(discord.Client):
             reply =  "Use the `report` command to begin the reporting process.\n"
             reply += "Use the `cancel` command to cancel the report process.\n"
             print("Send reply to help")
-            await message.channel.send(reply)
+            self.outbox.send(message.channel, reply)
             return
 
         author_id = message.author.id
@@ -186,62 +420,176 @@ class ModBot(discord.Client):
         # If we don't currently have an active report for this user, add one
         if author_id not in self.reports:
             self.reports[author_id] = Report(self)
+        report = self.reports[author_id]
         
         # Let the report class handle this message; forward all the messages it returns to us
-        responses = await self.reports[author_id].handle_message(message)
+        # The outbox sends consecutive responses as a single message
+        responses = await report.handle_message(message)
         for r in responses:
-            await message.channel.send(r)
+            self.outbox.send(message.channel, r)
 
         # If the report is complete or cancelled, remove it from our map
-        if self.reports[author_id].report_complete():
+        if report.report_complete():
+            # Remove complete/conacelled report from our map
+            self.reports.pop(author_id, None)
             # Get message ID corresponding to report
-            mid = self.reports[author_id].message_id
+            mid = report.message_id
             # Message ID identified (report completed)
             if mid > 0:
                 # Check if message should be forwarded
-                if self.reports[author_id].should_fwd or self.db.get_not_severe(mid) > 2:
-                    await self.fwd_reported(mid)
+                if report.should_fwd or await self.db.get_not_severe(mid) > 2:
+                    self.forwarder.request((report.channel_id, mid), author_id)
                 else:
-                    self.db.add_not_severe(mid)
-            # Remove complete/conacelled report from our map
-            self.reports.pop(author_id)
+                    await self.db.add_not_severe(mid)
 
     async def handle_mod_message(self, message):
+        if message.content.strip() == '!backfill' and message.author.id != self.user.id:
+            self.start_backfill(message)
+            return
+        if message.content.strip() == '!metrics' and message.author.id != self.user.id:
+            self.outbox.send(message.channel, self.metrics_summary(), merge=False)
+            return
         # Handle replies to reports in "group-#-mod" channel
-        if message.channel.name == f'group-{self.group_num}-mod':
-            # Message is a reply and message is not from bot
-            if message.reference is not None and message.author.id != self.user.id:
-                # Get prompt message
-                ref_id = message.reference.message_id
-                original_id = self.db.get_message_from_prompt(ref_id)
-                # Message requires content reviewer report
-                if original_id != None:
-                    # Add report to database
-                    time = message.created_at.strftime("%m/%d/%Y, %H:%M:%S")
-                    report = self.create_report(message.author.name, time, message.content)
-                    self.db.add_report(original_id, report)
-                    self.db.remove_prompt(ref_id)
-                    await message.reply(f'Successfully added content reviewer report for report message with ID {original_id}.')
+        # Message is a reply and message is not from bot
+        if message.reference is not None and message.author.id != self.user.id:
+            # Get prompt message
+            ref_id = message.reference.message_id
+            original_id = await self.db.get_message_from_prompt(ref_id)
+            # Message requires content reviewer report
+            if original_id != None:
+                # Add report to database
+                time = message.created_at.strftime("%m/%d/%Y, %H:%M:%S")
+                report = self.create_report(message.author.name, time, message.content)
+                await self.db.add_report(original_id, report)
+                await self.db.remove_prompt(ref_id)
+                self.outbox.reply(message, f'Successfully added content reviewer report for report message with ID {original_id}.')
 
     async def handle_channel_message(self, message):
 
-        if message.channel.name == f'group-{self.group_num}-mod':
+        mod_channel = self.mod_channels.get(message.guild.id)
+        if mod_channel is not None and message.channel.id == mod_channel.id:
             await self.handle_mod_message(message)
             return
 
-        # Only handle messages sent in the "group-#" channel
-        if not message.channel.name == f'group-{self.group_num}':
+        # Only handle messages sent in the "group-#" channels
+        if message.channel.id not in self.group_channels:
             return 
+        self.message_cache.put(message)
+        await self.pipeline.submit(message)
+
+    async def check_messages(self, messages, classifier=None, remote=True):
+        '''
+        Run the automated checks on a batch of group channel messages: reply to the ones containing blacklisted
+        addresses, and count a non-severe report for the others that the classifier or Perspective flags.
+        Perspective is skipped if remote is False.
+        '''
+        blacklisted, flagged = self.scan_messages(messages, classifier)
+        if remote and self.perspective is not None:
+            unflagged = [i for i in range(len(messages)) if not blacklisted[i] and not flagged[i]]
+            with self.pipeline.timed('perspective'):
+                scores = await self.perspective.score_batch([normalize(messages[i].content) for i in unflagged])
+            for i, score in zip(unflagged, scores):
+                flagged[i] = self.perspective.flags(score)
+        for message, hit in zip(messages, blacklisted):
+            if hit:
+                self.outbox.reply(message, "Message contains fraudulent or suspicious crypto address.")
+        for message, hit in zip(messages, flagged):
+            if hit:
+                with self.pipeline.timed('database'):
+                    await self.db.add_not_severe(message.id, self.live_checkpoint(message))
+
+    def live_checkpoint(self, message):
+        '''
+        Return the live checkpoint (see backfill.py) to save with the count of a message the ingest pipeline
+        flagged, so the backfill never counts it again, even after a restart.
+        '''
+        start = self.live_since.get(message.channel.id)
+        if start is None:
+            return None
+        return (Backfill.live_checkpoint_name(message.channel.id, start), message.id)
+
+    def scan_messages(self, messages, classifier=None):
+        '''
+        Given a batch of messages, return two lists of booleans: whether each message contains a blacklisted
+        address, and whether the classifier flags it (only checked for messages that aren't blacklisted).
+        '''
+        if classifier is None:
+            classifier = self.classifier
+        timed = self.pipeline.timed
+
+        with timed('normalize'):
+            # Check if messages are disguised in unicode
+            contents = [normalize(message.content) for message in messages]
+            # Only addresses with valid checksums are looked up or counted
+            addresses = extract_addresses_batch(contents)
 
         # Automated flagging using blacklist
-        if (self.check_blacklist(message)):
-            await message.reply("Message contains fraudulent or suspicious crypto address.")
-            return
+        with timed('blacklist'):
+            blacklisted = [self.check_blacklist(found) for found in addresses]
         
         # Automated flagging using classifier
-        if (self.check_classifier(message)):
-            self.db.add_not_severe(message.id)
+        unlisted = [i for i in range(len(messages)) if not blacklisted[i]]
+        with timed('classifier'):
+            hits = classifier.classify_batch([contents[i] for i in unlisted], [addresses[i] for i in unlisted])
+        flagged = [False] * len(messages)
+        for i, hit in zip(unlisted, hits):
+            flagged[i] = bool(hit)
+        return blacklisted, flagged
+
+    def scan_history(self, messages):
+        '''
+        Check a batch of messages from the group channel's history. Blacklisted and classifier-flagged messages
+        are both counted as flagged; the bot's own messages are skipped.
+        '''
+        blacklisted, flagged = self.scan_messages(messages)
+        return [message.author.id != self.user.id and (hit or flag) for message, hit, flag in zip(messages, blacklisted, flagged)]
+
+    def metrics_summary(self):
+        '''
+        Summarize the metrics, ingest queue and caches for the !metrics command, within Discord's length limit.
+        '''
+        summary = metrics.REGISTRY.summary() or 'No metrics recorded yet.'
+        pipeline = self.pipeline.stats()
+        summary += (f"\ningest queue: depth={pipeline['depth']} processed={pipeline['processed']} "
+                    f"dropped={pipeline['dropped']} shed={pipeline['shed']}")
+        summary += f"\nmessage cache hit rate: {self.message_cache.stats()['hit_rate']:.1%}"
+        summary += f"\ndatabase cache hit rate: {self.db.cache_stats()['hit_rate']:.1%}"
+        if len(summary) > 1900:
+            summary = summary[:1900].rsplit('\n', 1)[0] + '\n...'
+        return '```\n' + summary + '\n```'
+
+    def start_backfill(self, message):
+        if self.backfill_task is not None and not self.backfill_task.done():
+            self.outbox.reply(message, 'A backfill is already running.')
+            return
+        # Only the group channels that report to this mod channel are scanned
+        channels = [self.group_channels[channel_id] for channel_id, mod_channel in self.routes.items() if mod_channel.id == message.channel.id]
+        if not channels:
+            self.outbox.reply(message, 'No group channels report to this channel.')
+            return
+        names = ', '.join(f'#{channel.name}' for channel in channels)
+        self.outbox.reply(message, f'Scanning the history of {names}...')
+        self.backfill_task = asyncio.create_task(self.run_backfill(message, channels))
+
+    async def run_backfill(self, message, channels):
+        '''
+        Scan the history of the given group channels up to when the ingest pipeline started counting their
+        messages, resuming from their last checkpoints, and report back to the moderator who asked for it. Later
+        messages, and those counted by the pipeline before a restart, are skipped so none is counted twice.
+        '''
+        backfill = Backfill(self.scan_history, self.db, batch_size=config.get('backfill_batch_size', 100))
+        scanned = flagged = 0
+        try:
+            for channel in channels:
+                before = self.live_since.get(channel.id, discord.utils.time_snowflake(discord.utils.utcnow()))
+                channel_scanned, channel_flagged = await backfill.run(channel, before=before)
+                scanned += channel_scanned
+                flagged += channel_flagged
+        except Exception:
+            logger.exception('Backfill failed')
+            self.outbox.reply(message, f'Backfill stopped after {backfill.scanned} messages; run !backfill again to resume.')
             return
+        self.outbox.reply(message, f'Backfill complete: scanned {scanned} messages and flagged {flagged}.')
 
     def create_report(self, author, time, description):
         '''
@@ -254,37 +602,38 @@ class ModBot(discord.Client):
         }
         return report_dict
 
-    def check_blacklist(self, message):
-        with open("blacklist.txt", "r") as file:
-            addresses = file.readlines()
-            for add in addresses:
-                add = add.strip()
-                if add in message.content:
-                    return True
-        return False
-    
-    def check_classifier(self, message):
-
-        # Check if messages are disguised in unicode
-        content_decoded = unidecode(message.content, errors='preserve')
-        if content_decoded != message.content:
-            message.content = content_decoded
-
-        string = message.content
-        contains_btc_add = bool(re.search("[13][a-km-zA-HJ-NP-Z1-9]{25,34}", string))
-        contains_eth_add = bool(re.search("0x[a-fA-F0-9]{40}$", string))
-        phrases = ['legit', 'legitimate', 'send me', 'double', 'whatsapp']
-        legit_bot_phrases = ['transferred from', 'move from']
-        contains_scam_phrase = False
-        for phrase in phrases:
-            if phrase in string.lower():
-                contains_scam_phrase = True
-        contains_legit_phrase = False
-        for phrase in legit_bot_phrases:
-            if phrase in string.lower():
-                contains_legit_phrase = True
-        return ((not contains_legit_phrase) and (contains_btc_add or contains_eth_add or contains_scam_phrase))
+    def load_classifier(self):
+        '''
+        Load the classifier selected by the 'classifier' setting: the learned model trained with model.py, or the
+        phrase and address heuristic, which is also used when no trained model is available.
+        '''
+        if config.get('classifier', 'heuristic') == 'model':
+            model_path = config.get('model_path', 'model.npy')
+            if os.path.isfile(model_path):
+                # Imported here so NumPy is only loaded when the model is used
+                from model import ScamModel
+                return ScamModel.load(model_path, config.get('model_threshold', 0.5))
+            logger.warning(f'{model_path} not found, falling back to the heuristic classifier')
+        return ScamClassifier()
+
+    def check_blacklist(self, addresses):
+        return self.blacklist.find_addresses(addresses) is not None
             
-        
-client = ModBot(perspective_key)
-client.run(discord_token)
\ No newline at end of file
+
+
+# Only connect when run as a script, so the bot can be imported by benchmark.py
+if __name__ == '__main__':
+    setup_logging()
+
+    # There should be a file called 'token.json' inside the same folder as this file
+    token_path = 'tokens.json'
+    if not os.path.isfile(token_path):
+        raise Exception(f"{token_path} not found!")
+    with open(token_path) as f:
+        # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
+        tokens = json.load(f)
+        discord_token = tokens['discord']
+        perspective_key = tokens['perspective']
+
+    client = ModBot(perspective_key)
+    client.run(discord_token)
\ No newline at end of file
@@ -0,0 +1,48 @@
+import re
+from addresses import extract_addresses, extract_addresses_batch, signal_addresses
+
+SCAM_PHRASES = ['legit', 'legitimate', 'send me', 'double', 'whatsapp']
+LEGIT_BOT_PHRASES = ['transferred from', 'move from']
+
+def phrase_pattern(phrases):
+    '''
+    Given a list of phrases, compile a single regex that matches any of them.
+    '''
+    return re.compile('|'.join(re.escape(phrase) for phrase in sorted(phrases, key=len, reverse=True)))
+
+
+class ScamClassifier:
+    '''
+    Heuristic scam classifier. Patterns are compiled once, and each message is lowercased once and scanned with a
+    single combined matcher per phrase list, cheapest checks first. Only addresses with valid checksums count.
+    '''
+
+    def __init__(self, scam_phrases=SCAM_PHRASES, legit_phrases=LEGIT_BOT_PHRASES):
+        self.scam_pattern = phrase_pattern(scam_phrases)
+        self.legit_pattern = phrase_pattern(legit_phrases)
+
+    def classify(self, text, addresses=None):
+        '''
+        Given message text, return True if it looks like a scam: it contains a crypto address or a scam phrase,
+        and none of the phrases used by legitimate bots. Addresses already extracted from the text can be passed
+        in to avoid extracting them again.
+        '''
+        lowered = text.lower()
+        if self.legit_pattern.search(lowered):
+            return False
+        if self.scam_pattern.search(lowered):
+            return True
+        if addresses is None:
+            addresses = extract_addresses(text)
+        return bool(signal_addresses(addresses))
+
+    def classify_batch(self, texts, addresses=None):
+        '''
+        Given a list of message texts, return a list of verdicts in the same order. addresses, if given, is the
+        list of addresses already extracted from each text.
+        '''
+        texts = list(texts)
+        if addresses is None:
+            addresses = extract_addresses_batch(texts)
+        classify = self.classify
+        return [classify(text, found) for text, found in zip(texts, addresses)]
@@ -0,0 +1,130 @@
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+# File layout: header, the distinct address lengths, the Bloom filter bits, then the sorted fixed-width records.
+# Each record is the address padded with NUL bytes to the widest address, followed by its line number in the
+# source text file so lookups can still report which entry comes first.
+MAGIC = b'BLK1'
+VERSION = 1
+HEADER = struct.Struct('<4sHHHHQQ') # magic, version, width, hash count, number of lengths, record count, filter size
+LINE_NUMBER = struct.Struct('<I')
+BITS_PER_ENTRY = 10
+NUM_HASHES = 7
+
+def bloom_positions(key, num_bits, num_hashes):
+    '''
+    Given an encoded address, return the bit positions it sets in a Bloom filter of the given size.
+    '''
+    digest = hashlib.blake2b(key, digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return [(h1 + i * h2) % num_bits for i in range(num_hashes)]
+
+def convert(src_path, dst_path):
+    '''
+    Given a text blacklist with one address per line, write the compact binary format to dst_path.
+    Returns the number of addresses written. The file is replaced atomically, so a running bot that has the old
+    one memory-mapped keeps reading it until it reloads, and never sees a half-written file.
+    '''
+    entries = {}
+    with open(src_path, "r") as file:
+        for line_number, add in enumerate(file):
+            add = add.strip()
+            if not add or add in entries:
+                continue
+            if not add.isascii() or not add.isalnum():
+                print(f'Skipping line {line_number + 1}: {add!r} is not an alphanumeric address', file=sys.stderr)
+                continue
+            entries[add] = line_number
+
+    keys = sorted(add.encode('ascii') for add in entries)
+    width = max((len(key) for key in keys), default=1)
+    lengths = sorted({len(key) for key in keys})
+    num_bits = max(64, len(keys) * BITS_PER_ENTRY)
+    bloom = bytearray((num_bits + 7) // 8)
+    for key in keys:
+        for position in bloom_positions(key, len(bloom) * 8, NUM_HASHES):
+            bloom[position >> 3] |= 1 << (position & 7)
+
+    temporary = f'{dst_path}.tmp'
+    with open(temporary, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, width, NUM_HASHES, len(lengths), len(keys), len(bloom)))
+        file.write(struct.pack(f'<{len(lengths)}H', *lengths))
+        file.write(bloom)
+        for key in keys:
+            file.write(key.ljust(width, b'\0'))
+            file.write(LINE_NUMBER.pack(entries[key.decode('ascii')]))
+    os.replace(temporary, dst_path)
+    return len(keys)
+
+
+class CompactBlacklist:
+    '''
+    Read-only view of a converted blacklist. The file is memory-mapped, so opening it is constant time and
+    addresses are only paged in as lookups touch them.
+    '''
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.width, self.num_hashes, num_lengths, self.count, bloom_bytes = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception(f"{path} is not a compact blacklist file.")
+        offset = HEADER.size
+        self.lengths = list(struct.unpack_from(f'<{num_lengths}H', self.mm, offset))
+        offset += 2 * num_lengths
+        self.bloom_offset = offset
+        self.num_bits = bloom_bytes * 8
+        self.records_offset = offset + bloom_bytes
+        self.record_size = self.width + LINE_NUMBER.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        '''
+        Return the padded address stored in the record at the given index, so bisect can search the file directly.
+        '''
+        if index < 0 or index >= self.count:
+            raise IndexError(index)
+        start = self.records_offset + index * self.record_size
+        return self.mm[start:start + self.width]
+
+    def might_contain(self, key):
+        mm = self.mm
+        for position in bloom_positions(key, self.num_bits, self.num_hashes):
+            if not mm[self.bloom_offset + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def get(self, add, default=None):
+        '''
+        Given an address, return its line number in the original text file, or default if it is not blacklisted.
+        '''
+        key = add.encode('ascii', 'ignore')
+        if len(key) != len(add) or len(key) > self.width or not self.might_contain(key):
+            return default
+        padded = key.ljust(self.width, b'\0')
+        index = bisect.bisect_left(self, padded)
+        if index == self.count or self[index] != padded:
+            return default
+        start = self.records_offset + index * self.record_size + self.width
+        return LINE_NUMBER.unpack_from(self.mm, start)[0]
+
+    def __contains__(self, add):
+        return self.get(add) is not None
+
+    def close(self):
+        self.mm.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(f'Usage: python {sys.argv[0]} blacklist.txt blacklist.bin')
+        sys.exit(1)
+    count = convert(sys.argv[1], sys.argv[2])
+    print(f'Wrote {count} addresses to {sys.argv[2]}')
@@ -1,94 +1,448 @@
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import db
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from cache import MISSING, TTLCache
+import metrics
+from storage import FirebaseBackend
+
+logger = logging.getLogger('discord')
 
 class Database:
 
-    def __init__(self):
-        cred = credentials.Certificate('firebase-sdk.json')
-        firebase_admin.initialize_app(cred, {
-        'databaseURL': 'https://cs-152-group-23-default-rtdb.firebaseio.com/'
-        })
+    def __init__(self, backend=None, write_behind=False, flush_interval=0.5, flush_keys=100, cache_size=1024, cache_ttl=60.0):
+        '''
+        Reads and writes go to backend, a storage.StorageBackend (Firebase unless another one is given).
+        With write_behind enabled, non-severe counter increments are combined locally and written as a single
+        multi-path update every flush_interval seconds, or as soon as flush_keys messages have pending increments.
+        Reads go through an LRU cache of cache_size entries that each live for cache_ttl seconds.
+        '''
+        if backend is None:
+            backend = FirebaseBackend()
+        self.backend = backend
+
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.flush_keys = flush_keys
+        self.pending = {} # Map from message IDs to non-severe increments not yet written
+        self.in_flight = {} # Map from message IDs to increments being written by a flush
+        self.pending_checkpoints = {} # Map from checkpoint names to message IDs to save with the pending increments
+        # Also guards the cache's bookkeeping: writing maps cache keys to the number of writes to them in
+        # progress, and reads maps them to tokens of backend reads a write has not yet overtaken
+        self.pending_lock = threading.Lock()
+        self.writes_done = threading.Condition(self.pending_lock)
+        self.writing = {}
+        self.reads = {}
+        # Updates that save checkpoints are written one at a time, each with the highest message ID saved so far
+        # for its checkpoints, so a slower update can't move a checkpoint back
+        self.checkpoint_lock = threading.Lock()
+        self.checkpoints = {}
+        self.stopped = threading.Event()
+        # Keys are (kind, ID) tuples: ('not_severe', message ID), ('record', message ID), ('prompt', prompt ID)
+        # or ('forward', forwarded message ID). Records are cached as (limit, record)
+        self.cache = TTLCache(cache_size, cache_ttl)
+        if write_behind:
+            threading.Thread(target=self.flush_periodically, daemon=True).start()
 
     def create_message_record(self, message_id):
         '''
         Given a message ID, create a new record for its reports in the database.
         '''
-        ref = db.reference('/')
-        ref.update({
-            f'Messages/{message_id}': {
-                'cr_reports': {},
-                'cr_report_count': 0,
-                'non_severe_count': 0
-            },
-        })
+        with self.writing_keys(('record', message_id), ('not_severe', message_id)):
+            self.backend.create_message_record(message_id)
+            self.cache.invalidate(('record', message_id))
+            self.cache.invalidate(('not_severe', message_id))
     
     def add_report(self, message_id, report):
         '''
         Given a content reviewer report containing author, time, and description, adds the report to the database.
         '''
-        num_cr_reports = db.reference(f'Messages/{message_id}/cr_report_count').get()
-        if num_cr_reports is None:
-            self.create_message_record(message_id)
-            num_cr_reports = db.reference(f'Messages/{message_id}/cr_report_count').get()
-        
-        ref = db.reference(f'Messages/{message_id}')
-        ref.update({
-            f'cr_reports/{num_cr_reports + 1}': report,
-            'cr_report_count': num_cr_reports + 1
-        })
+        with self.writing_keys(('record', message_id)):
+            self.backend.add_report(message_id, report)
+            self.cache.invalidate(('record', message_id))
 
     def add_prompt(self, prompt_id, message_id):
         '''
         Given the message ID of a prompt and the ID of the original message, add the information to the database.
         '''
-        ref = db.reference('/')
-        ref.update({
-            f'Prompts/{prompt_id}': message_id
-        })
+        with self.writing_keys(('prompt', prompt_id)):
+            self.backend.add_prompt(prompt_id, message_id)
+            self.cache.put(('prompt', prompt_id), message_id)
     
     def get_message_from_prompt(self, prompt_id):
         '''
         Given the message ID of a prompt, return the original message corresponding to it.
         '''
-        ref = db.reference(f'Prompts/{prompt_id}')
-        return ref.get()
+        # Most replies in the mod channel are not to prompts, so None is cached as well
+        return self.read_through(('prompt', prompt_id), lambda: self.backend.get_message_from_prompt(prompt_id))
 
     def remove_prompt(self, prompt_id):
         '''
         Given the message ID of a prompt, remove it from the database.
         '''
-        ref = db.reference(f'Prompts/{prompt_id}')
-        ref.delete()
+        with self.writing_keys(('prompt', prompt_id)):
+            self.backend.remove_prompt(prompt_id)
+            self.cache.put(('prompt', prompt_id), None)
 
-    def get_cr_reports(self, message_id):
+    def add_forward(self, forward_id, message_id, channel_id):
+        '''
+        Given the ID of a report forwarded to the mod channel, record the ID and channel of the original message.
         '''
-        Given the message ID of the original message, retrieve its content reviewer reports.
+        with self.writing_keys(('forward', forward_id)):
+            self.backend.add_forward(forward_id, message_id, channel_id)
+            self.cache.put(('forward', forward_id), (message_id, channel_id))
+
+    def get_forward(self, forward_id):
         '''
-        ref = db.reference(f'Messages/{message_id}')
-        return ref.get()
+        Given a message ID in the mod channel, return (message ID, channel ID) of the original message if it is a
+        forwarded report, or None otherwise.
+        '''
+        return self.read_through(('forward', forward_id), lambda: self.backend.get_forward(forward_id))
+
+    def get_cr_reports(self, message_id, limit=None):
+        '''
+        Given the message ID of the original message, retrieve its latest limit content reviewer reports (all of
+        them if limit is None) and the total number of reports.
+        '''
+        return self.read_through(
+            ('record', message_id),
+            lambda: (limit, self.backend.get_cr_reports(message_id, limit)),
+            usable=lambda cached: cached[0] == limit,
+        )[1]
     
     def get_not_severe(self, message_id):
         '''
         Given the message ID of a message, retrieve its count for the number of non-severe reports.
+        Increments that are still waiting to be written are included.
+        '''
+        # The count and the unwritten increments are read together, so an increment is never missed or counted
+        # twice while a flush moves it from one to the other
+        return self.read_through(
+            ('not_severe', message_id),
+            lambda: self.backend.get_not_severe(message_id),
+            finish=lambda count: count + self.unwritten(message_id),
+        )
+
+    def unwritten(self, message_id):
+        return self.pending.get(message_id, 0) + self.in_flight.get(message_id, 0)
+
+    def read_through(self, key, read, usable=None, finish=None):
+        '''
+        Return the cached value for key if there is one and usable(value) is true, otherwise the value read()
+        returns from the backend, which is cached. A read waits for writes to key in progress, and is retried if a
+        write starts before it finishes, so a value that a write has made stale is never cached or returned.
+        finish(value), if given, is returned instead of the value, computed under the same lock as writes finish.
+        '''
+        while True:
+            with self.pending_lock:
+                value = self.cache.get(key)
+                if value is not MISSING and (usable is None or usable(value)):
+                    return value if finish is None else finish(value)
+                while self.writing.get(key):
+                    self.writes_done.wait()
+                token = object()
+                self.reads.setdefault(key, set()).add(token)
+            try:
+                value = read()
+            except BaseException:
+                with self.pending_lock:
+                    self.finish_read(key, token)
+                raise
+            with self.pending_lock:
+                if self.finish_read(key, token):
+                    self.cache.put(key, value)
+                    return value if finish is None else finish(value)
+
+    def finish_read(self, key, token):
+        '''
+        Forget a read started by read_through, returning whether no write to key started since. The caller holds
+        pending_lock.
+        '''
+        tokens = self.reads.get(key)
+        if tokens is None or token not in tokens:
+            return False
+        tokens.discard(token)
+        if not tokens:
+            del self.reads[key]
+        return True
+
+    def start_writes(self, keys):
+        '''
+        Mark keys as being written, so reads of them wait and reads already in progress are retried. The caller
+        holds pending_lock.
+        '''
+        for key in keys:
+            self.writing[key] = self.writing.get(key, 0) + 1
+            self.reads.pop(key, None)
+
+    def finish_writes(self, keys):
+        for key in keys:
+            if self.writing[key] > 1:
+                self.writing[key] -= 1
+            else:
+                del self.writing[key]
+        self.writes_done.notify_all()
+
+    @contextmanager
+    def writing_keys(self, *keys):
+        '''
+        Mark keys as being written for the duration of the with statement, whose cache changes are made before
+        waiting reads resume.
+        '''
+        with self.pending_lock:
+            self.start_writes(keys)
+        try:
+            yield
+        finally:
+            with self.pending_lock:
+                self.finish_writes(keys)
+
+    def add_not_severe(self, message_id, checkpoint=None):
+        '''
+        Given the message ID of a message, increment its count for the number of non-severe reports. If checkpoint
+        is a (name, message ID) pair, it is saved in the same update.
+        '''
+        checkpoints = dict([checkpoint]) if checkpoint is not None else {}
+        if not self.write_behind:
+            self.increment_not_severe({message_id: 1}, checkpoints)
+            return
+        with self.pending_lock:
+            self.pending[message_id] = self.pending.get(message_id, 0) + 1
+            merge_checkpoints(self.pending_checkpoints, checkpoints)
+            full = len(self.pending) >= self.flush_keys
+        if full:
+            self.flush()
+
+    def increment_not_severe(self, deltas, checkpoints=None):
+        '''
+        Given a map from message IDs to increments, atomically add them to the non-severe counts in one update.
+        checkpoints, a map from checkpoint names to message IDs, is saved in the same update. A checkpoint never
+        moves back to an earlier message.
+        '''
+        if not deltas and not checkpoints:
+            return
+        keys = written_keys(deltas)
+        with self.pending_lock:
+            self.start_writes(keys)
+        try:
+            self.write_increments(deltas, checkpoints)
+            with self.pending_lock:
+                self.apply_written(deltas)
+        finally:
+            with self.pending_lock:
+                self.finish_writes(keys)
+
+    def write_increments(self, deltas, checkpoints):
+        if not checkpoints:
+            self.backend.increment_not_severe(deltas)
+            return
+        with self.checkpoint_lock:
+            checkpoints = {name: max(message_id, self.checkpoints.get(name, message_id)) for name, message_id in checkpoints.items()}
+            self.backend.increment_not_severe(deltas, checkpoints)
+            self.checkpoints.update(checkpoints)
+
+    def apply_written(self, deltas):
+        # No read can fill these keys while they are being written, so a cached count predates the write
+        for message_id, delta in deltas.items():
+            self.cache.update(('not_severe', message_id), lambda count, delta=delta: count + delta)
+            self.cache.invalidate(('record', message_id))
+
+    def flush(self):
+        '''
+        Write all pending non-severe increments, with the checkpoints saved with them. Until the write finishes they are kept in in_flight, so reads
+        still include them; if it fails they are moved back to pending for the next flush.
+        '''
+        with self.pending_lock:
+            deltas, checkpoints = self.pending, self.pending_checkpoints
+            self.pending, self.pending_checkpoints = {}, {}
+            merge(self.in_flight, deltas)
+            keys = written_keys(deltas)
+            self.start_writes(keys)
+        if not deltas and not checkpoints:
+            return
+        try:
+            self.write_increments(deltas, checkpoints)
+        except Exception:
+            with self.pending_lock:
+                merge(self.in_flight, deltas, -1)
+                merge(self.pending, deltas)
+                merge_checkpoints(self.pending_checkpoints, checkpoints)
+                self.finish_writes(keys)
+            raise
+        with self.pending_lock:
+            merge(self.in_flight, deltas, -1)
+            self.apply_written(deltas)
+            self.finish_writes(keys)
+
+    def flush_periodically(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush non-severe counts, will retry')
+
+    def get_checkpoint(self, name):
+        '''
+        Given the name of a checkpoint, return the message ID saved for it, or None. Checkpoints are not cached.
+        '''
+        return self.backend.get_checkpoint(name)
+
+    def get_checkpoints(self, prefix):
+        '''
+        Return a map from the name of every checkpoint starting with prefix to its message ID.
+        '''
+        return self.backend.get_checkpoints(prefix)
+
+    def cache_stats(self):
+        '''
+        Return the read cache's size, hits, misses and hit rate. Every hit is a network read saved.
+        '''
+        return self.cache.stats()
+
+    def close(self):
+        '''
+        Stop the background flusher, write any pending increments and close the backend.
+        '''
+        self.stopped.set()
+        self.flush()
+        self.backend.close()
+
+def written_keys(deltas):
+    return [key for message_id in deltas for key in (('not_severe', message_id), ('record', message_id))]
+
+def merge(counts, deltas, sign=1):
+    '''
+    Add (or with sign -1, subtract) each of deltas to counts, dropping counts that reach zero.
+    '''
+    for message_id, delta in deltas.items():
+        count = counts.get(message_id, 0) + sign * delta
+        if count:
+            counts[message_id] = count
+        else:
+            counts.pop(message_id, None)
+
+def merge_checkpoints(checkpoints, updates):
+    for name, message_id in updates.items():
+        checkpoints[name] = max(message_id, checkpoints.get(name, message_id))
+
+class AsyncDatabase:
+    '''
+    Asyncio interface to a Database. Each call runs on a bounded thread pool, so a slow request to the database
+    holds up only the coroutine awaiting it, not the event loop.
+    '''
+
+    def __init__(self, database, max_workers=4, timeout=10.0):
+        '''
+        database is a Database, or a function that creates one. A function is only called by open(), on the
+        thread pool, so slow setup such as initializing Firebase can overlap with other startup work; calls made
+        before then wait for it. At most max_workers calls run at once; the rest queue for a free thread. A call
+        that takes longer than timeout seconds raises asyncio.TimeoutError in the awaiting coroutine (the thread
+        still finishes it).
+        '''
+        self.database = database if isinstance(database, Database) else None
+        self.factory = database
+        self.opening = None # Future for the Database being created by factory
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='database')
+
+    def open(self, on_failure=None):
+        '''
+        Start creating the Database in the background if it was given as a function. Must be called from a
+        running event loop. If creating it fails, the error is logged and on_failure, if given, is called with it.
+        '''
+        if self.database is None and self.opening is None:
+            self.opening = asyncio.get_running_loop().run_in_executor(self.executor, self.factory)
+            self.opening.add_done_callback(functools.partial(self.opened, on_failure))
+
+    def opened(self, on_failure, future):
+        if future.cancelled() or future.exception() is None:
+            return
+        logger.error('Failed to open the database', exc_info=future.exception())
+        if on_failure is not None:
+            on_failure(future.exception())
+
+    async def get_database(self):
+        if self.database is None:
+            self.open()
+            self.database = await self.opening
+        return self.database
+
+    async def run(self, method, *args):
+        '''
+        Call the named Database method with args on the thread pool.
+        '''
+        database = await self.get_database()
+        loop = asyncio.get_running_loop()
+        # Timed from the caller's point of view, so waiting for a free thread is included
+        with metrics.timed('database_seconds', help='Time taken by Database calls', method=method):
+            try:
+                future = loop.run_in_executor(self.executor, functools.partial(getattr(database, method), *args))
+                return await asyncio.wait_for(future, self.timeout)
+            except Exception:
+                metrics.increment('database_errors_total', help='Database calls that failed or timed out', method=method)
+                raise
+
+    async def create_message_record(self, message_id):
+        return await self.run('create_message_record', message_id)
+
+    async def add_report(self, message_id, report):
+        return await self.run('add_report', message_id, report)
+
+    async def add_prompt(self, prompt_id, message_id):
+        return await self.run('add_prompt', prompt_id, message_id)
+
+    async def get_message_from_prompt(self, prompt_id):
+        return await self.run('get_message_from_prompt', prompt_id)
+
+    async def remove_prompt(self, prompt_id):
+        return await self.run('remove_prompt', prompt_id)
+
+    async def add_forward(self, forward_id, message_id, channel_id):
+        return await self.run('add_forward', forward_id, message_id, channel_id)
+
+    async def get_forward(self, forward_id):
+        return await self.run('get_forward', forward_id)
+
+    async def get_cr_reports(self, message_id, limit=None):
+        return await self.run('get_cr_reports', message_id, limit)
+
+    async def get_not_severe(self, message_id):
+        return await self.run('get_not_severe', message_id)
+
+    async def add_not_severe(self, message_id, checkpoint=None):
+        return await self.run('add_not_severe', message_id, checkpoint)
+
+    async def increment_not_severe(self, deltas, checkpoints=None):
+        return await self.run('increment_not_severe', deltas, checkpoints)
+
+    async def get_checkpoint(self, name):
+        return await self.run('get_checkpoint', name)
+
+    async def get_checkpoints(self, prefix):
+        return await self.run('get_checkpoints', prefix)
+
+    async def flush(self):
+        return await self.run('flush')
+
+    def cache_stats(self):
+        if self.database is None:
+            return TTLCache().stats()
+        return self.database.cache_stats()
+
+    async def close(self):
+        '''
+        Write pending increments, then shut down the thread pool once in-flight calls finish. If the Database
+        could not be opened there is nothing to write.
         '''
-        ref = db.reference(f'Messages/{message_id}/non_severe_count')
-        non_severe_count = ref.get()
-        if non_severe_count == None:
-            return 0
-        return non_severe_count
-
-    def add_not_severe(self, message_id):
-        '''
-        Given the message ID of a message, increment its count for the number of non-severe reports.
-        '''
-        ref = db.reference(f'Messages/{message_id}/non_severe_count')
-        non_severe_count = ref.get()
-        if non_severe_count == None:
-            non_severe_count = 0
-            self.create_message_record(message_id)
-        
-        ref = db.reference(f'Messages/{message_id}')
-        ref.update({
-            'non_severe_count': non_severe_count + 1
-        })
\ No newline at end of file
+        try:
+            if self.database is None and self.opening is not None:
+                try:
+                    await self.get_database()
+                except Exception:
+                    return
+            if self.database is not None:
+                await self.run('close')
+        finally:
+            self.executor.shutdown(wait=False)
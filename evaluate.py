@@ -0,0 +1,128 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from addresses import CANDIDATE_PATTERNS, validate_batch
+from classifier import ScamClassifier
+from normalize import normalize
+
+LABEL_COLUMN = 'labels(0:non-scam; 1:scam)'
+TEXT_COLUMN = 'tweet'
+
+def load_dataset(path):
+    '''
+    Load the labeled tweet dataset the same way classifier.ipynb does: missing labels count as non-scam.
+    '''
+    dataset = pd.read_csv(path)
+    dataset[LABEL_COLUMN] = dataset[LABEL_COLUMN].fillna(0).astype(bool)
+    dataset[TEXT_COLUMN] = dataset[TEXT_COLUMN].astype('str')
+    return dataset
+
+def decode_column(texts):
+    '''
+    Apply the bot's normalization step, but only to the rows that actually contain non-ASCII characters.
+    '''
+    non_ascii = texts.str.contains('[^\x00-\x7f]', regex=True)
+    if non_ascii.any():
+        texts = texts.copy()
+        texts[non_ascii] = texts[non_ascii].map(normalize)
+    return texts
+
+def matching_rows(pattern, joined, ends):
+    '''
+    Given a compiled pattern, the texts joined with NUL separators, and the offset just past each text's
+    separator, return a boolean array marking the rows that contain a match.
+    '''
+    rows = np.zeros(len(ends), dtype=bool)
+    starts = np.fromiter((match.start() for match in pattern.finditer(joined)), dtype=np.int64)
+    rows[np.searchsorted(ends, starts, side='right')] = True
+    return rows
+
+def address_rows(joined, ends):
+    '''
+    Return a boolean array marking the rows that contain a crypto address with a valid checksum. Each distinct
+    candidate string is validated once, however many rows it appears in. Bare ETH addresses don't count, as in
+    addresses.signal_addresses.
+    '''
+    starts = []
+    candidates = []
+    for chain, pattern in CANDIDATE_PATTERNS:
+        for match in pattern.finditer(joined):
+            if chain == 'eth' and not match.group().startswith('0x'):
+                continue
+            starts.append(match.start())
+            candidates.append(match.group())
+    valid = validate_batch(candidates)
+    rows = np.zeros(len(ends), dtype=bool)
+    starts = np.asarray([start for start, candidate in zip(starts, candidates) if candidate in valid], dtype=np.int64)
+    rows[np.searchsorted(ends, starts, side='right')] = True
+    return rows
+
+def classify_column(texts, classifier=None):
+    '''
+    Given a Series of message texts, return a boolean array of the bot's verdicts. Rather than one Python call
+    per row, each of the classifier's compiled patterns is run once over all texts joined with NUL separators
+    (which none of the patterns can match across), and matches are mapped back to rows with a binary search.
+    '''
+    if classifier is None:
+        classifier = ScamClassifier()
+    texts = decode_column(texts)
+    if len(texts) == 0:
+        return np.zeros(0, dtype=bool)
+    joined = '\x00'.join(texts) + '\x00'
+    ends = np.cumsum(np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)) + 1)
+    lowered = joined.lower()
+    lowered_ends = ends
+    if len(lowered) != len(joined):
+        # A few characters lowercase to more than one character, so the row offsets have to be recomputed
+        lowered_ends = np.cumsum(np.fromiter((len(text.lower()) for text in texts), dtype=np.int64, count=len(texts)) + 1)
+
+    legit = matching_rows(classifier.legit_pattern, lowered, lowered_ends)
+    scam = matching_rows(classifier.scam_pattern, lowered, lowered_ends)
+    addresses = address_rows(joined, ends)
+    return ~legit & (scam | addresses)
+
+def confusion_matrix(labels, predictions):
+    '''
+    Return the 2x2 confusion matrix [[TN, FP], [FN, TP]] for boolean labels and predictions.
+    '''
+    return np.bincount(labels.astype(np.int64) * 2 + predictions.astype(np.int64), minlength=4).reshape(2, 2)
+
+def report(labels, predictions, elapsed):
+    matrix = confusion_matrix(labels, predictions)
+    (tn, fp), (fn, tp) = matrix
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    accuracy = (tp + tn) / len(labels) if len(labels) else 0.0
+    print(f'Rows: {len(labels)}')
+    print(f'Precision: {precision:.4f}')
+    print(f'Recall: {recall:.4f}')
+    print(f'Accuracy: {accuracy:.4f}')
+    print('Confusion matrix (rows: actual non-scam/scam, columns: predicted non-scam/scam):')
+    print(f'  {tn:>8} {fp:>8}')
+    print(f'  {fn:>8} {tp:>8}')
+    print(f'Throughput: {len(labels) / elapsed if elapsed else float("inf"):.0f} rows/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluate the bot's scam classifier on a labeled tweet dataset.")
+    parser.add_argument('dataset', nargs='?', default='twitterdataset.csv')
+    parser.add_argument('--model', help='evaluate a model trained with model.py instead of the heuristic')
+    parser.add_argument('--show-errors', action='store_true', help='print the misclassified tweets')
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.dataset)
+    labels = dataset[LABEL_COLUMN].to_numpy(dtype=bool)
+    start = time.perf_counter()
+    if args.model:
+        from model import ScamModel
+        texts = decode_column(dataset[TEXT_COLUMN]).tolist()
+        predictions = np.asarray(ScamModel.load(args.model).classify_batch(texts), dtype=bool)
+    else:
+        predictions = classify_column(dataset[TEXT_COLUMN])
+    elapsed = time.perf_counter() - start
+    report(labels, predictions, elapsed)
+
+    if args.show_errors:
+        errors = dataset.loc[labels != predictions, [LABEL_COLUMN, TEXT_COLUMN]]
+        print(errors.to_string())
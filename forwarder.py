@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger('discord')
+
+class ForwardCoalescer:
+    '''
+    Coalesces forwards of reported messages to the mod channel. Reports of the same message are collected until
+    no new report has arrived for `window` seconds (or `max_delay` seconds have passed since the first one), then
+    forwarded once with the number of users who reported it. While a forward is open, later reports update that
+    forward instead of posting a new one; it is closed once a moderator acts on it, or forgotten `ttl` seconds
+    after it was last updated if no moderator does.
+    '''
+
+    def __init__(self, forward, window=5.0, max_delay=20.0, ttl=86400.0):
+        '''
+        forward is a coroutine function called as forward(message_id, reporter_count, forward_id), where
+        forward_id is the ID of the open forward to edit, or None to post a new one. It returns the ID of the
+        forward it posted or edited. message_id can be any key identifying the message, such as the bot's
+        (channel ID, message ID) pairs.
+        '''
+        self.forward = forward
+        self.window = window
+        self.max_delay = max_delay
+        self.ttl = ttl
+        self.reporters = {} # Map from message ID to the set of users who reported it while its forward was open
+        self.first_requested = {} # Map from message ID to when the current batch of reports started
+        self.timers = {} # Map from message ID to the pending call that will forward it
+        self.open_forwards = {} # Map from message ID to the ID of its forward in the mod channel
+        self.forwarded = OrderedDict() # Map from message ID to when it was last forwarded, oldest first
+
+    def request(self, message_id, reporter_id):
+        '''
+        Schedule a forward of the given message, reported by the given user.
+        '''
+        now = time.monotonic()
+        self.expire(now)
+        self.reporters.setdefault(message_id, set()).add(reporter_id)
+        first = self.first_requested.setdefault(message_id, now)
+        timer = self.timers.pop(message_id, None)
+        if timer is not None:
+            timer.cancel()
+        delay = max(0.0, min(self.window, first + self.max_delay - now))
+        loop = asyncio.get_running_loop()
+        self.timers[message_id] = loop.call_later(delay, lambda: asyncio.create_task(self.flush(message_id)))
+
+    async def flush(self, message_id):
+        self.timers.pop(message_id, None)
+        self.first_requested.pop(message_id, None)
+        reporter_count = len(self.reporters.get(message_id, ()))
+        self.forwarded[message_id] = time.monotonic()
+        self.forwarded.move_to_end(message_id)
+        try:
+            forward_id = await self.forward(message_id, reporter_count, self.open_forwards.get(message_id))
+        except Exception:
+            logger.exception(f'Failed to forward message {message_id}')
+            return
+        if message_id in self.reporters:
+            self.open_forwards[message_id] = forward_id
+
+    def expire(self, now):
+        '''
+        Forget the reporters and open forwards of messages last forwarded more than ttl seconds ago, so messages
+        no moderator acts on don't accumulate. A message waiting to be forwarded again is kept.
+        '''
+        while self.forwarded:
+            message_id, forwarded_at = next(iter(self.forwarded.items()))
+            if now - forwarded_at < self.ttl:
+                break
+            del self.forwarded[message_id]
+            if message_id not in self.timers:
+                self.reporters.pop(message_id, None)
+                self.open_forwards.pop(message_id, None)
+
+    def close(self, message_id):
+        '''
+        Mark the forward of the given message as handled, so that new reports start a new forward.
+        '''
+        self.open_forwards.pop(message_id, None)
+        # Reports still waiting to be forwarded keep their count for the new forward
+        if message_id not in self.timers:
+            self.reporters.pop(message_id, None)
+            self.forwarded.pop(message_id, None)
+
+    async def flush_all(self):
+        '''
+        Forward every message that is still waiting for its window to end.
+        '''
+        message_ids = list(self.timers)
+        for message_id in message_ids:
+            self.timers[message_id].cancel()
+        await asyncio.gather(*(self.flush(message_id) for message_id in message_ids))
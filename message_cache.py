@@ -0,0 +1,63 @@
+import logging
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger('discord')
+
+class MessageCache:
+    '''
+    Size-bounded LRU cache of recent group channel messages, keyed by message ID, so messages the bot has just
+    seen don't have to be fetched again over the rate-limited REST API.
+    '''
+
+    def __init__(self, max_size=1000, report_every=1000):
+        '''
+        Keeps at most max_size messages, and logs the hit rate every report_every lookups.
+        '''
+        self.max_size = max_size
+        self.report_every = report_every
+        self.messages = OrderedDict() # Map from message ID to message, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, message):
+        self.messages[message.id] = message
+        self.messages.move_to_end(message.id)
+        if len(self.messages) > self.max_size:
+            self.messages.popitem(last=False)
+
+    def evict(self, message_id):
+        self.messages.pop(message_id, None)
+
+    def get(self, message_id):
+        message = self.messages.get(message_id)
+        if message is None:
+            self.misses += 1
+        else:
+            self.messages.move_to_end(message_id)
+            self.hits += 1
+        if self.report_every and (self.hits + self.misses) % self.report_every == 0:
+            logger.info(f'Message cache: {self.stats()}')
+        return message
+
+    async def fetch(self, channel, message_id):
+        '''
+        Return the message with the given ID from the cache, or fetch it from the channel and cache it.
+        Raises the same errors as channel.fetch_message on a miss.
+        '''
+        message = self.get(message_id)
+        if message is None:
+            with metrics.timed('discord_rest_seconds', help='Time taken by Discord REST calls', call='fetch_message'):
+                message = await channel.fetch_message(message_id)
+            self.put(message)
+        return message
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.messages),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,183 @@
+import asyncio
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('discord')
+
+# Upper bounds in seconds, from 50 microseconds to 10 seconds
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Counter:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def increment(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+class Histogram:
+    '''
+    Fixed-bucket histogram: each observation is one bisect and a few additions, and quantiles are estimated from
+    the bucket bounds.
+    '''
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'lock')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # The last count is for observations above every bound
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        '''
+        Return the upper bound of the bucket holding the q-th quantile (inf if it is above every bound).
+        '''
+        with self.lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return 0.0
+        target = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+class Registry:
+    '''
+    Named counters and histograms, each with its own set of label values, exported in the Prometheus text format.
+    '''
+
+    def __init__(self):
+        self.metrics = {} # Map from metric name to (kind, help text, map from label tuple to Counter or Histogram)
+        self.lock = threading.Lock()
+
+    def get(self, kind, name, help, labels):
+        key = tuple(sorted(labels.items()))
+        family = self.metrics.get(name)
+        if family is None or key not in family[2]:
+            with self.lock:
+                family = self.metrics.setdefault(name, (kind, help, {}))
+                if key not in family[2]:
+                    family[2][key] = Counter() if kind == 'counter' else Histogram()
+        return family[2][key]
+
+    def increment(self, name, amount=1, help='', **labels):
+        self.get('counter', name, help, labels).increment(amount)
+
+    def observe(self, name, seconds, help='', **labels):
+        self.get('histogram', name, help, labels).observe(seconds)
+
+    @contextmanager
+    def timed(self, name, help='', **labels):
+        '''
+        Observe how many seconds the body of the with statement takes in the named histogram.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, help, **labels)
+
+    def export(self):
+        '''
+        Return every metric in the Prometheus text exposition format.
+        '''
+        lines = []
+        with self.lock:
+            families = [(name, kind, help, list(series.items())) for name, (kind, help, series) in sorted(self.metrics.items())]
+        for name, kind, help, series in families:
+            if help:
+                lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, metric in series:
+                if kind == 'counter':
+                    lines.append(f'{name}{format_labels(labels)} {metric.value}')
+                    continue
+                with metric.lock:
+                    counts, count, total = list(metric.counts), metric.count, metric.sum
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {total}')
+                lines.append(f'{name}_count{format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        '''
+        Return a short human-readable summary: the count, mean, p50 and p99 of each histogram, and each counter.
+        '''
+        lines = []
+        with self.lock:
+            families = [(name, kind, list(series.items())) for name, (kind, help, series) in sorted(self.metrics.items())]
+        for name, kind, series in families:
+            for labels, metric in series:
+                label = name + format_labels(labels)
+                if kind == 'counter':
+                    lines.append(f'{label}: {metric.value}')
+                elif metric.count:
+                    lines.append(f'{label}: n={metric.count} mean={1000 * metric.sum / metric.count:.2f}ms '
+                                 f'p50<={1000 * metric.quantile(0.5):g}ms p99<={1000 * metric.quantile(0.99):g}ms')
+        return '\n'.join(lines)
+
+    def write(self, path):
+        '''
+        Atomically replace the file at path with the current export, e.g. for node_exporter's textfile collector.
+        '''
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as f:
+            f.write(self.export())
+        os.replace(temporary, path)
+
+    async def write_periodically(self, path, interval=15.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.write(path)
+            except OSError:
+                logger.exception(f'Failed to write metrics to {path}')
+
+    async def serve(self, host='127.0.0.1', port=9100):
+        '''
+        Serve the export at http://host:port/metrics until the returned runner is cleaned up.
+        '''
+        from aiohttp import web
+        async def handle(request):
+            return web.Response(text=self.export(), content_type='text/plain', charset='utf-8')
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+# The registry shared by the bot's modules
+REGISTRY = Registry()
+increment = REGISTRY.increment
+observe = REGISTRY.observe
+timed = REGISTRY.timed
@@ -0,0 +1,192 @@
+import argparse
+import math
+import re
+import zlib
+import numpy as np
+from addresses import extract_addresses, signal_addresses
+
+NUM_FEATURES = 2 ** 18
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+# Splits ASCII text into the same words as WORD_PATTERN does after lowercasing, much faster: translate lowercases
+# word characters and turns every other byte into a space
+WORD_BYTES = b"abcdefghijklmnopqrstuvwxyz0123456789'"
+WORD_TABLE = bytes(
+    byte if byte in WORD_BYTES else byte + 32 if ord('A') <= byte <= ord('Z') else ord(' ')
+    for byte in range(256)
+)
+# Bigrams are hashed from the hashes of their words; the multiplier is odd, so "a b" and "b a" hash apart
+BIGRAM_MULTIPLIER = 0x9E3779B1
+WORD_CACHE_SIZE = 65536
+
+def crc32(token):
+    return zlib.crc32(token.encode('utf-8'))
+
+class WordHashes(dict):
+    '''
+    Map from words, as UTF-8 bytes, to their crc32 hashes, computed on first use. Chat vocabulary is small, so
+    most words are a dictionary hit; the map is cleared whenever it reaches max_size, so it never grows unbounded.
+    '''
+
+    def __init__(self, max_size=WORD_CACHE_SIZE):
+        super().__init__()
+        self.max_size = max_size
+
+    def __missing__(self, word):
+        if len(self) >= self.max_size:
+            self.clear()
+        value = self[word] = zlib.crc32(word)
+        return value
+
+WORD_HASHES = WordHashes()
+ADDRESS_HASHES = {'btc': crc32('__btc_address__'), 'eth': crc32('__eth_address__')}
+
+def words(text):
+    '''
+    Given message text, return its lowercased words as UTF-8 bytes.
+    '''
+    if text.isascii():
+        return text.encode('ascii').translate(WORD_TABLE).split()
+    return [word.encode('utf-8') for word in WORD_PATTERN.findall(text.lower())]
+
+def word_hashes(text):
+    return list(map(WORD_HASHES.__getitem__, words(text)))
+
+def address_hashes(addresses):
+    return [ADDRESS_HASHES[chain] for chain in {address.chain for address in signal_addresses(addresses)}]
+
+def hash_features(text, num_features=NUM_FEATURES, addresses=None):
+    '''
+    Given message text, return the hashed feature indices for its words, word bigrams and crypto addresses.
+    crc32 is used rather than hash() so the indices are the same in every process. Addresses already extracted
+    from the text can be passed in.
+    '''
+    hashes = word_hashes(text)
+    hashes += [a * BIGRAM_MULTIPLIER + b for a, b in zip(hashes, hashes[1:])]
+    if addresses is None:
+        addresses = extract_addresses(text)
+    hashes += address_hashes(addresses)
+    return [h % num_features for h in hashes]
+
+def vectorize(texts, num_features=NUM_FEATURES, addresses=None):
+    '''
+    Given a list of texts, return the hashed feature matrix in coordinate form: a row index and a column index
+    for every feature occurrence. Repeated features add up, as they would in a dense count matrix. The features
+    are the same as hash_features', but the bigrams and indices of the whole batch are computed with NumPy.
+    '''
+    if addresses is None:
+        addresses = [extract_addresses(text) for text in texts]
+    hashes = []
+    lengths = []
+    address_rows = []
+    address_columns = []
+    for row, (text, found) in enumerate(zip(texts, addresses)):
+        words = word_hashes(text)
+        hashes += words
+        lengths.append(len(words))
+        if found:
+            for h in address_hashes(found):
+                address_rows.append(row)
+                address_columns.append(h)
+    words = np.asarray(hashes, dtype=np.uint64)
+    word_rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+    # Pairs of neighbouring words are bigrams unless they come from different texts
+    same_text = word_rows[1:] == word_rows[:-1]
+    bigrams = (words[:-1] * np.uint64(BIGRAM_MULTIPLIER) + words[1:])[same_text]
+    rows = np.concatenate([word_rows, word_rows[1:][same_text], np.asarray(address_rows, dtype=np.int64)])
+    columns = np.concatenate([words, bigrams, np.asarray(address_columns, dtype=np.uint64)]) % np.uint64(num_features)
+    return rows, columns.astype(np.int64)
+
+def sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class ScamModel:
+    '''
+    Logistic regression over hashed text features. The weights, with the bias in the last slot, are a single
+    NumPy array, so a batch of messages is scored with one sparse matrix-vector product.
+    '''
+
+    def __init__(self, weights, threshold=0.5):
+        self.weights = weights
+        self.num_features = len(weights) - 1
+        # Plain list copy for scoring single messages, where NumPy's per-call overhead would dominate
+        self.weight_list = weights.tolist()
+        self.threshold = threshold
+
+    @classmethod
+    def load(cls, path, threshold=0.5):
+        return cls(np.load(path), threshold)
+
+    def save(self, path):
+        np.save(path, self.weights)
+
+    def score_batch(self, texts, addresses=None):
+        '''
+        Given a list of texts, return an array of scam probabilities.
+        '''
+        rows, columns = vectorize(texts, self.num_features, addresses)
+        z = np.bincount(rows, weights=self.weights[columns], minlength=len(texts)) + self.weights[-1]
+        return sigmoid(z)
+
+    def classify(self, text, addresses=None):
+        weight_list = self.weight_list
+        z = weight_list[-1] + sum(weight_list[feature] for feature in hash_features(text, self.num_features, addresses))
+        return 1.0 / (1.0 + math.exp(-min(max(z, -30.0), 30.0))) >= self.threshold
+
+    def classify_batch(self, texts, addresses=None):
+        '''
+        Given a list of texts, return a list of verdicts in the same order.
+        '''
+        if not texts:
+            return []
+        return (self.score_batch(list(texts), addresses) >= self.threshold).tolist()
+
+    @classmethod
+    def train(cls, texts, labels, num_features=NUM_FEATURES, epochs=10, batch_size=1024, learning_rate=0.5, l2=1e-6):
+        '''
+        Fit the model with mini-batch gradient descent on the log loss.
+        '''
+        labels = np.asarray(labels, dtype=np.float64)
+        weights = np.zeros(num_features + 1)
+        features = [hash_features(text, num_features) for text in texts]
+        order = np.arange(len(texts))
+        rng = np.random.default_rng(0)
+        for epoch in range(epochs):
+            rng.shuffle(order)
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                rows = np.concatenate([np.full(len(features[i]), row, dtype=np.int64) for row, i in enumerate(batch)])
+                columns = np.concatenate([np.asarray(features[i], dtype=np.int64) for i in batch])
+                z = np.bincount(rows, weights=weights[columns], minlength=len(batch)) + weights[-1]
+                error = sigmoid(z) - labels[batch]
+                gradient = np.bincount(columns, weights=error[rows], minlength=num_features) / len(batch)
+                weights[:-1] -= learning_rate * (gradient + l2 * weights[:-1])
+                weights[-1] -= learning_rate * error.mean()
+        return cls(weights)
+
+
+if __name__ == '__main__':
+    from evaluate import LABEL_COLUMN, TEXT_COLUMN, decode_column, load_dataset, report
+    import time
+
+    parser = argparse.ArgumentParser(description='Train the hashed logistic regression scam model.')
+    parser.add_argument('dataset', nargs='?', default='twitterdataset.csv')
+    parser.add_argument('--output', default='model.npy')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--holdout', type=float, default=0.2, help='fraction of rows held out for evaluation')
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.dataset).sample(frac=1.0, random_state=0)
+    split = int(len(dataset) * (1 - args.holdout))
+    train, test = dataset.iloc[:split], dataset.iloc[split:]
+    # The bot scores normalized text, so the model is trained and evaluated on the same
+    texts = decode_column(dataset[TEXT_COLUMN])
+    train_texts, test_texts = texts.iloc[:split].tolist(), texts.iloc[split:].tolist()
+    model = ScamModel.train(train_texts, train[LABEL_COLUMN].to_numpy(), epochs=args.epochs)
+    model.save(args.output)
+    print(f'Saved model trained on {len(train)} rows to {args.output}')
+
+    if len(test):
+        start = time.perf_counter()
+        predictions = np.asarray(model.classify_batch(test_texts), dtype=bool)
+        report(test[LABEL_COLUMN].to_numpy(dtype=bool), predictions, time.perf_counter() - start)
@@ -0,0 +1,21 @@
+import functools
+from unidecode import unidecode
+
+CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def transliterate(char):
+    '''
+    Given a single non-ASCII character, return its ASCII transliteration. Scam messages reuse a small set of
+    lookalike characters, so these are cached rather than looked up in unidecode's tables every time.
+    '''
+    return unidecode(char, errors='preserve')
+
+def normalize(text):
+    '''
+    Given message content, return a copy with Unicode lookalike characters transliterated to ASCII, so that
+    disguised addresses and phrases can be matched. Plain ASCII text is returned unchanged without any work.
+    '''
+    if text.isascii():
+        return text
+    return ''.join(char if char.isascii() else transliterate(char) for char in text)
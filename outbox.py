@@ -0,0 +1,164 @@
+import asyncio
+import logging
+from collections import deque
+
+import discord
+
+import metrics
+
+logger = logging.getLogger('discord')
+
+MAX_MESSAGE_LENGTH = 2000
+
+class Outbox:
+    '''
+    Central queue for the messages the bot sends. Each channel is a separate bucket drained by its own task, so a
+    rate-limited channel doesn't hold up the others, and consecutive messages queued for the same channel (replying
+    to the same message, if any) are merged into a single send of up to 2000 characters. Handlers queue messages
+    and return right away; sends that are rate limited are retried in the background.
+    '''
+
+    def __init__(self, max_concurrent=8, max_retries=5, retry_delay=1.0):
+        '''
+        At most max_concurrent sends are in flight at once across all channels. A send that gets a 429 response
+        is retried up to max_retries times, waiting for the delay given by Discord, or retry_delay seconds if it
+        doesn't give one.
+        '''
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queues = {} # Map from channel ID to the deque of (content, reference, merge, future) waiting to be sent
+        self.channels = {} # Map from channel ID to the channel to send to
+        self.tasks = {} # Map from channel ID to the task draining its queue
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+        self.failed = 0
+
+    def send(self, channel, content, reference=None, merge=True):
+        '''
+        Queue content to be sent to the channel, as a reply to reference if given. Returns a future for the
+        discord.Message it ends up in, which only needs to be awaited if the sent message is needed. Pass
+        merge=False for messages that must be sent on their own, such as ones whose ID is recorded.
+        '''
+        future = asyncio.get_running_loop().create_future()
+        # Failures are logged by the outbox, so callers that don't await the future don't need to handle them
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.channels[channel.id] = channel
+        self.queues.setdefault(channel.id, deque()).append((content, reference, merge, future))
+        if channel.id not in self.tasks:
+            self.tasks[channel.id] = asyncio.create_task(self.drain(channel.id))
+        return future
+
+    def reply(self, message, content):
+        '''
+        Queue content to be sent as a reply to message. Returns a future like send.
+        '''
+        return self.send(message.channel, content, reference=message)
+
+    def next_batch(self, queue):
+        '''
+        Take the next message off a channel queue, together with the messages after it that can be merged into
+        the same send. Returns (content, reference, futures).
+        '''
+        content, reference, merge, future = queue.popleft()
+        futures = [future]
+        while merge and queue:
+            next_content, next_reference, next_merge, next_future = queue[0]
+            if not next_merge or not same_reference(reference, next_reference):
+                break
+            if len(content) + 1 + len(next_content) > MAX_MESSAGE_LENGTH:
+                break
+            queue.popleft()
+            content += '\n' + next_content
+            futures.append(next_future)
+        self.merged += len(futures) - 1
+        return content, reference, futures
+
+    async def drain(self, channel_id):
+        channel = self.channels[channel_id]
+        queue = self.queues[channel_id]
+        try:
+            while queue:
+                content, reference, futures = self.next_batch(queue)
+                try:
+                    sent = await self.deliver(channel, content, reference)
+                except asyncio.CancelledError:
+                    for future in futures:
+                        future.cancel()
+                    raise
+                except Exception as e:
+                    self.failed += 1
+                    logger.exception(f'Failed to send a message to channel {channel_id}')
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self.sent += 1
+                for future in futures:
+                    if not future.done():
+                        future.set_result(sent)
+        finally:
+            self.tasks.pop(channel_id, None)
+            if not queue:
+                self.queues.pop(channel_id, None)
+                self.channels.pop(channel_id, None)
+
+    async def deliver(self, channel, content, reference):
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.semaphore:
+                    with metrics.timed('discord_rest_seconds', help='Time taken by Discord REST calls', call='send'):
+                        return await channel.send(content, reference=reference)
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt == self.max_retries:
+                    raise
+                self.retried += 1
+                metrics.increment('discord_rate_limited_total', help='Discord REST calls answered with a 429', call='send')
+                await asyncio.sleep(retry_after(e, self.retry_delay))
+
+    async def close(self, timeout=10.0):
+        '''
+        Give the queued messages up to timeout seconds to be sent, then drop the rest.
+        '''
+        tasks = list(self.tasks.values())
+        if not tasks:
+            return
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logger.warning(f'Dropping {sum(len(queue) for queue in self.queues.values())} queued outbound messages')
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for queue in self.queues.values():
+            for _, _, _, future in queue:
+                future.cancel()
+        self.queues.clear()
+        self.channels.clear()
+
+    def stats(self):
+        return {
+            'queued': sum(len(queue) for queue in self.queues.values()),
+            'channels': len(self.tasks),
+            'sent': self.sent,
+            'merged': self.merged,
+            'retried': self.retried,
+            'failed': self.failed,
+        }
+
+
+def same_reference(a, b):
+    if a is None or b is None:
+        return a is b
+    return a.id == b.id
+
+def retry_after(error, default):
+    '''
+    Return how many seconds Discord asked us to wait before retrying a rate-limited request.
+    '''
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After', default))
+    except (TypeError, ValueError):
+        return default
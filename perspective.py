@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import logging
+
+import aiohttp
+
+from cache import MISSING, TTLCache
+import metrics
+
+logger = logging.getLogger('discord')
+
+API_URL = 'https://commentanalyzer.googleapis.com/v1alpha1/comments:analyze'
+
+class PerspectiveClient:
+    '''
+    Async client for the Perspective API. Texts to score are collected into micro-batches: a batch is sent once
+    batch_size distinct texts are waiting or batch_window seconds after the first one, and identical texts within
+    a batch are only scored once. The API scores one comment per request, so a batch is sent as concurrent
+    requests over one pooled session, at most max_concurrent at a time. Scores are cached by a hash of the text.
+    '''
+
+    def __init__(self, key, url=API_URL, attributes=('TOXICITY', 'SPAM'), thresholds=None, max_concurrent=4,
+                 batch_size=16, batch_window=0.05, cache_size=10000, cache_ttl=3600.0, timeout=10.0):
+        '''
+        thresholds maps attributes to the score at which a text is flagged (0.8 for any attribute not given).
+        Requests taking longer than timeout seconds fail, and a failed text is scored as None and not cached.
+        '''
+        self.key = key
+        self.url = url
+        self.attributes = attributes
+        self.thresholds = {attribute: 0.8 for attribute in attributes}
+        self.thresholds.update(thresholds or {})
+        self.max_concurrent = max_concurrent
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.session = None # Created on first use, since it needs a running event loop
+        self.pending = {} # Map from text hash to the text, for texts waiting for the next batch
+        self.futures = {} # Map from text hash to the future of its scores, for texts waiting or being scored
+        self.timer = None
+        self.requests = 0
+        self.failures = 0
+
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrent)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self.session
+
+    async def score(self, text):
+        '''
+        Return a map from attribute to score for the text, or None if it couldn't be scored.
+        '''
+        key = hashlib.sha1(text.encode('utf-8')).digest()
+        scores = self.cache.get(key)
+        if scores is not MISSING:
+            return scores
+        if key in self.futures:
+            return await asyncio.shield(self.futures[key])
+        future = self.futures[key] = asyncio.get_running_loop().create_future()
+        self.pending[key] = text
+        if len(self.pending) >= self.batch_size:
+            self.send_batch()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.batch_window, self.send_batch)
+        return await asyncio.shield(future)
+
+    async def score_batch(self, texts):
+        '''
+        Given a list of texts, return a list of their scores as returned by score.
+        '''
+        return await asyncio.gather(*(self.score(text) for text in texts))
+
+    def flags(self, scores):
+        '''
+        Return whether any score is at or above its attribute's threshold.
+        '''
+        return scores is not None and any(score >= self.thresholds[attribute] for attribute, score in scores.items())
+
+    def send_batch(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch = self.pending
+        self.pending = {}
+        if batch:
+            asyncio.create_task(self.request_batch(batch))
+
+    async def request_batch(self, batch):
+        results = await asyncio.gather(*(self.request(text) for text in batch.values()), return_exceptions=True)
+        for key, scores in zip(batch, results):
+            if isinstance(scores, BaseException):
+                self.failures += 1
+                logger.warning(f'Perspective request failed: {scores!r}')
+                scores = None
+            else:
+                self.cache.put(key, scores)
+            future = self.futures.pop(key, None)
+            if future is not None and not future.done():
+                future.set_result(scores)
+
+    async def request(self, text):
+        body = {
+            'comment': {'text': text},
+            'languages': ['en'],
+            'requestedAttributes': {attribute: {} for attribute in self.attributes},
+            'doNotStore': True,
+        }
+        async with self.semaphore:
+            self.requests += 1
+            with metrics.timed('perspective_request_seconds', help='Time taken by Perspective API requests'):
+                async with self.get_session().post(self.url, params={'key': self.key}, json=body) as response:
+                    response.raise_for_status()
+                    result = await response.json()
+        return {
+            attribute: score['summaryScore']['value']
+            for attribute, score in result.get('attributeScores', {}).items()
+        }
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'cache': self.cache.stats(),
+        }
+
+    async def close(self):
+        '''
+        Close the session. Texts still waiting for a batch are scored as None.
+        '''
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        for key in self.pending:
+            future = self.futures.pop(key)
+            if not future.done():
+                future.set_result(None)
+        self.pending = {}
+        if self.session is not None:
+            await self.session.close()
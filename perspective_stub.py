@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import hashlib
+import random
+
+from aiohttp import web
+
+from classifier import SCAM_PHRASES
+
+class PerspectiveStub:
+    '''
+    Local stand-in for the Perspective API's comments:analyze endpoint, so the bot and load tests can be run
+    without network access or quota. Scores are deterministic: SPAM is high for texts containing a known scam
+    phrase, and the other attributes are derived from a hash of the text.
+    '''
+
+    def __init__(self, latency=0.0, error_rate=0.0):
+        '''
+        Each request is delayed by latency seconds, and a fraction error_rate of them are answered with a 429.
+        '''
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.rate_limited = 0
+
+    def score(self, text, attribute):
+        lowered = text.lower()
+        if attribute == 'SPAM' and any(phrase in lowered for phrase in SCAM_PHRASES):
+            return 0.95
+        digest = hashlib.sha1(f'{attribute}:{text}'.encode('utf-8')).digest()
+        return digest[0] / 255 * 0.5
+
+    async def analyze(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self.rate_limited += 1
+            return web.json_response({'error': {'code': 429, 'message': 'Quota exceeded'}}, status=429)
+        body = await request.json()
+        text = body['comment']['text']
+        return web.json_response({
+            'attributeScores': {
+                attribute: {'summaryScore': {'value': self.score(text, attribute), 'type': 'PROBABILITY'}}
+                for attribute in body.get('requestedAttributes', {})
+            },
+            'languages': body.get('languages', ['en']),
+        })
+
+    async def stats(self, request):
+        return web.json_response({'requests': self.requests, 'rate_limited': self.rate_limited})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/v1alpha1/comments:analyze', self.analyze)
+        app.router.add_get('/stats', self.stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local stub of the Perspective API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to delay each response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 429')
+    args = parser.parse_args()
+    # Point the bot at it with "perspective_url": "http://127.0.0.1:8080/v1alpha1/comments:analyze" in config.json
+    web.run_app(PerspectiveStub(args.latency, args.error_rate).app(), host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
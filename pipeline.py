@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+import metrics
+
+logger = logging.getLogger('discord')
+
+class StageTimer:
+    '''
+    Running count, total and maximum of the time spent in one stage of the pipeline.
+    '''
+
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'mean_ms': 1000 * self.total / self.count if self.count else 0.0,
+            'max_ms': 1000 * self.max,
+        }
+
+
+class IngestPipeline:
+    '''
+    Bounded queue of channel messages drained in batches by a pool of worker tasks, so a burst of messages is
+    checked in the background instead of holding up the gateway event handlers.
+
+    When the queue is full, the policy decides what happens to a new message:
+    'block' waits for room, 'drop' discards it, and 'shed' checks it right away with the cheap checks only.
+    '''
+
+    POLICIES = ('block', 'drop', 'shed')
+
+    def __init__(self, process_batch, process_shed, workers=4, max_size=1000, batch_size=16, policy='block', report_interval=60):
+        '''
+        process_batch is a coroutine function given a list of messages to check. process_shed is a coroutine
+        function given a single message when the 'shed' policy applies. Stats are logged every report_interval
+        seconds (never if it is 0).
+        '''
+        if policy not in self.POLICIES:
+            raise Exception(f"Unknown backpressure policy {policy!r}. Choose one of: {', '.join(self.POLICIES)}.")
+        self.process_batch = process_batch
+        self.process_shed = process_shed
+        self.num_workers = workers
+        self.batch_size = batch_size
+        self.policy = policy
+        self.report_interval = report_interval
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.tasks = []
+        self.stages = {} # Map from stage name to its StageTimer
+        self.processed = 0
+        self.dropped = 0
+        self.shed = 0
+
+    def start(self):
+        '''
+        Start the worker tasks. Must be called from a running event loop.
+        '''
+        for _ in range(self.num_workers):
+            self.tasks.append(asyncio.create_task(self.work()))
+        if self.report_interval:
+            self.tasks.append(asyncio.create_task(self.report_periodically()))
+
+    async def stop(self, timeout=10.0):
+        '''
+        Give the workers up to timeout seconds to finish the queued messages, then stop them.
+        '''
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f'Stopping ingest pipeline with {self.queue.qsize()} messages still queued')
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def submit(self, message):
+        '''
+        Queue a message to be checked, applying the backpressure policy if the queue is full.
+        '''
+        item = (time.perf_counter(), message)
+        if self.policy == 'block':
+            await self.queue.put(item)
+            return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.policy == 'drop':
+                self.dropped += 1
+                metrics.increment('ingest_dropped_total', help='Channel messages dropped because the ingest queue was full')
+            else:
+                self.shed += 1
+                metrics.increment('ingest_shed_total', help='Channel messages checked with the cheap checks only because the ingest queue was full')
+                with self.timed('shed'):
+                    await self.process_shed(message)
+
+    async def work(self):
+        while True:
+            items = [await self.queue.get()]
+            while len(items) < self.batch_size and not self.queue.empty():
+                items.append(self.queue.get_nowait())
+            now = time.perf_counter()
+            for queued_at, _ in items:
+                self.record('queue', now - queued_at)
+            try:
+                with self.timed('batch'):
+                    await self.process_batch([message for _, message in items])
+                self.processed += len(items)
+            except Exception:
+                logger.exception('Failed to process a batch of channel messages')
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    def record(self, stage, seconds):
+        timer = self.stages.get(stage)
+        if timer is None:
+            timer = self.stages[stage] = StageTimer()
+        timer.record(seconds)
+        metrics.observe('ingest_stage_seconds', seconds, help='Time spent in each stage of checking channel messages', stage=stage)
+
+    @contextmanager
+    def timed(self, stage):
+        '''
+        Record how long the body of the with statement takes as one sample of the given stage.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def stats(self):
+        return {
+            'depth': self.queue.qsize(),
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'shed': self.shed,
+            'stages': {stage: timer.stats() for stage, timer in self.stages.items()},
+        }
+
+    async def report_periodically(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            logger.info(f'Ingest pipeline: {self.stats()}')
@@ -1,6 +1,8 @@
 from enum import Enum, auto
+from collections import namedtuple
 import discord
 import re
+import time
 
 class State(Enum):
     REPORT_START = auto()
@@ -22,10 +24,77 @@ class State(Enum):
     CHECK_MONEY = auto()
     ACTION_NEEDED = auto()
 
+# Prompts shared by several states
+INVESTIGATE = "We will investigate this message and get back to you soon."
+CHOOSE_NUMBER = "Please choose a number."
+ANSWER_YES_OR_NO = "Please answer yes or no."
+SCAM_REASONS = "What's wrong with this message or the user who posted it? Please type the number corresponding to one of the following reasons: \n1. Tweet is sending people to misleading url. \n2. Account is impersonating someone else. \n3. Something else"
+LOST_MONEY = "Have you lost money due to interaction with this account? Please answer yes or no."
+ANYTHING_ELSE = "Anything else you would like to report? Please answer yes or no"
+BLOCK_OR_MUTE = "Would like to block or mute the account? Please answer block or mute."
+
+# What to do next: the state to move to, the replies to send, and whether the report should be forwarded
+Transition = namedtuple('Transition', ['state', 'replies', 'forward'], defaults=[False])
+
+# For each state that expects particular answers, a map from answer to transition, and the replies for anything else
+TRANSITIONS = {
+    State.MESSAGE_IDENTIFIED: ({
+        "1": Transition(State.REPORT_COMPLETE, [INVESTIGATE]),
+        "2": Transition(State.SCAM_FOUND, ["Is this message related to finance (investment, buying crytocurrencies etc.)? Please answer yes or no."]),
+        "3": Transition(State.REPORT_COMPLETE, [INVESTIGATE]),
+        "4": Transition(State.MISLEADING_REASON, ["Why is this message misleading? Please type the number corresponding to one of the following reasons: 1. Politices 2. Health 3. Something else"]),
+        "5": Transition(State.REPORT_COMPLETE, [INVESTIGATE]),
+    }, [CHOOSE_NUMBER]),
+    State.MISLEADING_REASON: ({
+        "1": Transition(State.REPORT_COMPLETE, [INVESTIGATE]),
+        "2": Transition(State.REPORT_COMPLETE, [INVESTIGATE]),
+        "3": Transition(State.CHECK_TYPE, ["Is this message related to finance (investment, buying crytocurrencies etc.) Please answer yes or no."]),
+    }, [CHOOSE_NUMBER]),
+    State.CHECK_TYPE: ({
+        "yes": Transition(State.SCAM_IDENTIFIED, [SCAM_REASONS]),
+        "no": Transition(State.ACTION_NEEDED, [BLOCK_OR_MUTE]),
+    }, [ANSWER_YES_OR_NO]),
+    State.SCAM_FOUND: ({
+        "yes": Transition(State.SCAM_IDENTIFIED, [SCAM_REASONS]),
+        "no": Transition(State.NOT_RELATED_TO_FINANCE, ["What is the tweet related to? Please type the number corresponding to one of the following reasons: \n1. The account that posted the message is fake. \n2. the message contains links to potentially harmful, malicious, phishing site. \n3. The hashtags seem unrelated. \n4. The message is a spam. \n5. Something else"]),
+    }, [ANSWER_YES_OR_NO]),
+    State.NOT_RELATED_TO_FINANCE: ({
+        answer: Transition(State.REPORT_COMPLETE, [INVESTIGATE]) for answer in ["1", "2", "3", "4", "5"]
+    }, [CHOOSE_NUMBER]),
+    State.SCAM_IDENTIFIED: ({
+        answer: Transition(State.CHECK_MONEY, [LOST_MONEY]) for answer in ["1", "2", "3"]
+    }, [CHOOSE_NUMBER]),
+    State.CHECK_MONEY: ({
+        "yes": Transition(State.REPORT_ELSE, [ANYTHING_ELSE], forward=True),
+        "no": Transition(State.REPORT_ELSE, [ANYTHING_ELSE]),
+    }, [ANSWER_YES_OR_NO]),
+    State.REPORT_ELSE: ({
+        "yes": Transition(State.ADDITIONAL_INFO, ["Please type any information you think is relevant."]),
+        "no": Transition(State.ACTION_NEEDED, [BLOCK_OR_MUTE]),
+    }, [ANSWER_YES_OR_NO]),
+    State.ACTION_NEEDED: ({
+        "block": Transition(State.REPORT_COMPLETE, ["Thanks for reporting! We've blocked the account."]),
+        "mute": Transition(State.REPORT_COMPLETE, ["Thanks for reporting! We've muted the account."]),
+    }, ["Please answer block or mute."]),
+}
+
+# States that move on whatever the user says
+ANY_ANSWER = {
+    State.REPORT_START: Transition(State.AWAITING_MESSAGE, [
+        "Thank you for starting the reporting process. "
+        "Say `help` at any time for more information.\n\n"
+        "Please copy paste the link to the message you want to report.\n"
+        "You can obtain this link by right-clicking the message and clicking `Copy Message Link`."
+    ]),
+    State.ADDITIONAL_INFO: Transition(State.ACTION_NEEDED, [BLOCK_OR_MUTE]),
+}
+
 class Report:
     START_KEYWORD = "report"
     CANCEL_KEYWORD = "cancel"
     HELP_KEYWORD = "help"
+
+    __slots__ = ('state', 'client', 'message', 'message_id', 'channel_id', 'should_fwd', 'last_active')
     
     def __init__(self, client):
         self.state = State.REPORT_START
@@ -34,167 +103,64 @@ class Report:
 
         # For report flow
         self.message_id = -1
+        self.channel_id = None
         self.should_fwd = False
+        self.last_active = time.monotonic()
     
     async def handle_message(self, message):
         '''
-        This function makes up the meat of the user-side reporting flow. It defines how we transition between states and what 
-        prompts to offer at each of those states. You're welcome to change anything you want; this skeleton is just here to
-        get you started and give you a model for working with Discord. 
+        This function makes up the meat of the user-side reporting flow. Transitions between states and the prompts
+        offered at each of them are defined in the TRANSITIONS and ANY_ANSWER tables above; only identifying the
+        reported message needs code of its own.
         '''
+        self.last_active = time.monotonic()
 
         if message.content == self.CANCEL_KEYWORD:
             self.state = State.REPORT_COMPLETE
             return ["Report cancelled."]
-        
-        if self.state == State.REPORT_START:
-            reply =  "Thank you for starting the reporting process. "
-            reply += "Say `help` at any time for more information.\n\n"
-            reply += "Please copy paste the link to the message you want to report.\n"
-            reply += "You can obtain this link by right-clicking the message and clicking `Copy Message Link`."
-            self.state = State.AWAITING_MESSAGE
-            return [reply]
-        
-        if self.state == State.AWAITING_MESSAGE:
-            # Parse out the three ID strings from the message link
-            m = re.search('/(\d+)/(\d+)/(\d+)', message.content)
-            if not m:
-                return ["I'm sorry, I couldn't read that link. Please try again or say `cancel` to cancel."]
-            guild = self.client.get_guild(int(m.group(1)))
-            if not guild:
-                return ["I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again."]
-            channel = guild.get_channel(int(m.group(2)))
-            if not channel:
-                return ["It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel."]
-            try:
-                message = await channel.fetch_message(int(m.group(3)))
-            except discord.errors.NotFound:
-                return ["It seems this message was deleted or never existed. Please try again or say `cancel` to cancel."]
-
-            # Here we've found the message - it's up to you to decide what to do next!
-            self.state = State.MESSAGE_IDENTIFIED
-            self.message_id = message.id
-            return ["I found this message:", "```" + message.author.name + ": " + message.content + "```", \
-                    "Help us understand the problem. What's going on with this message? Please type the number of the following reasons: \n1. I am not interested in this message. \n2. It's suspicious or a scam. \n3. It's abusive or harmful. \n4. It's misleading. \n5. It expresses intentions of self-harm or suicide."]
-      
-        if self.state == State.MESSAGE_IDENTIFIED:
-            if message.content == "1": 
-                self.state = State.REPORT_COMPLETE
-                return ["We will investigate this message and get back to you soon."]
-            elif message.content == "2": 
-                self.state = State.SCAM_FOUND
-                return ["Is this message related to finance (investment, buying crytocurrencies etc.)? Please answer yes or no."]
-
-            elif message.content == "3": 
-                self.state = State.REPORT_COMPLETE
-                return ["We will investigate this message and get back to you soon."]
-
-            elif message.content == "4": 
-                self.state = State.MISLEADING_TYPE
-                
-            elif message.content == "5": 
-                self.state = State.REPORT_COMPLETE
-                return ["We will investigate this message and get back to you soon."]
-            else: 
-                return["Please choose a number."]
-        if self.state == State.MISLEADING_TYPE: 
-            self.state = State.MISLEADING_REASON
-            return ["Why is this message misleading? Please type the number corresponding to one of the following reasons: 1. Politices 2. Health 3. Something else"]
-
-        if self.state == State.MISLEADING_REASON: 
-            if message.content == "1":
-                self.state = State.REPORT_COMPLETE
-                return ["We will investigate this message and get back to you soon."]  
-            elif message.content == "2":
-                self.state = State.REPORT_COMPLETE
-                return ["We will investigate this message and get back to you soon."]
-            elif message.content == "3":
-                self.state = State.CHECK_TYPE
-                return ["Is this message related to finance (investment, buying crytocurrencies etc.) Please answer yes or no."]
-            else: 
-                return ["Please choose a number."]
-
-        if self.state == State.CHECK_TYPE:
-            if message.content == "yes": 
-                self.state = State.SCAM_IDENTIFIED
-                return ["What's wrong with this message or the user who posted it? Please type the number corresponding to one of the following reasons: \n1. Tweet is sending people to misleading url. \n2. Account is impersonating someone else. \n3. Something else"]
-            elif message.content == "no":
-                self.state = State.ACTION_NEEDED
-                return ["Would like to block or mute the account? Please answer block or mute."]
-            else: 
-                return["Please answer yes or no."]
-
-        if self.state == State.SCAM_FOUND:
-            if message.content == "yes": 
-                self.state = State.SCAM_IDENTIFIED
-                return ["What's wrong with this message or the user who posted it? Please type the number corresponding to one of the following reasons: \n1. Tweet is sending people to misleading url. \n2. Account is impersonating someone else. \n3. Something else"]
-            elif message.content == "no":
-                self.state = State.NOT_RELATED_TO_FINANCE
-                return ["What is the tweet related to? Please type the number corresponding to one of the following reasons: \n1. The account that posted the message is fake. \n2. the message contains links to potentially harmful, malicious, phishing site. \n3. The hashtags seem unrelated. \n4. The message is a spam. \n5. Something else"]
-            else: 
-                return["Please answer yes or no."]
-                
-        if self.state == State.NOT_RELATED_TO_FINANCE: 
-            if message.content == "1" or message.content == "2" or message.content == "3" or message.content == "4" or message.content == "5": 
-                self.state= State.REPORT_COMPLETE
-                return ["We will investigate this message and get back to you soon."]
-            else: 
-                return["Please choose a number."]
-
-        if self.state == State.SCAM_IDENTIFIED:
-            if message.content == "1":
-                self.state = State.CHECK_MONEY 
-                return ["Have you lost money due to interaction with this account? Please answer yes or no."]
-            elif message.content == "2":
-                self.state = State.CHECK_MONEY 
-                return ["Have you lost money due to interaction with this account? Please answer yes or no."]
-            elif message.content == "3":
-                self.state = State.CHECK_MONEY 
-                return ["Have you lost money due to interaction with this account? Please answer yes or no."]    
-            else: 
-                return["Please choose a number."]
 
-        if self.state == State.CHECK_MONEY:
-            if message.content == "yes":
-                self.should_fwd = True
-                self.state = State.MONEY_CHECKED
-                
-            elif message.content == "no":
-                self.state = State.MONEY_CHECKED        
-            else: 
-                return["Please answer yes or no."]
-
-        if self.state == State.MONEY_CHECKED: 
-            self.state = State.REPORT_ELSE
-            return ["Anything else you would like to report? Please answer yes or no"]
-
-        if self.state == State.REPORT_ELSE:
-            if message.content == "yes":
-                self.state = State.ADDITIONAL_INFO
-                return ["Please type any information you think is relevant."]
-            elif message.content == "no":
-                self.state = State.ACTION_NEEDED     
-                return ["Would like to block or mute the account? Please answer block or mute."]  
-            else: 
-                return["Please answer yes or no."]
-        if self.state == State.ACTION_NEEDED: 
-            if message.content== "block": 
-                self.state = State.REPORT_COMPLETE  
-                return ["Thanks for reporting! We've blocked the account."]
-            elif message.content == "mute":
-                self.state = State.REPORT_COMPLETE  
-                return ["Thanks for reporting! We've muted the account."]
-            else: 
-                return ["Please answer block or mute."]
-
-        if self.state == State.ADDITIONAL_INFO:
-            self.state = State.ACTION_NEEDED     
-            return ["Would like to block or mute the account? Please answer block or mute."]  
+        if self.state == State.AWAITING_MESSAGE:
+            return await self.identify_message(message)
+
+        transition = ANY_ANSWER.get(self.state)
+        if transition is None:
+            transitions, otherwise = TRANSITIONS[self.state]
+            transition = transitions.get(message.content)
+            if transition is None:
+                return list(otherwise)
+        self.state = transition.state
+        if transition.forward:
+            self.should_fwd = True
+        return list(transition.replies)
+
+    async def identify_message(self, message):
+        # Parse out the three ID strings from the message link
+        m = re.search('/(\d+)/(\d+)/(\d+)', message.content)
+        if not m:
+            return ["I'm sorry, I couldn't read that link. Please try again or say `cancel` to cancel."]
+        guild = self.client.get_guild(int(m.group(1)))
+        if not guild:
+            return ["I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again."]
+        channel = guild.get_channel(int(m.group(2)))
+        if not channel:
+            return ["It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel."]
+        try:
+            message = await self.client.message_cache.fetch(channel, int(m.group(3)))
+        except discord.errors.NotFound:
+            return ["It seems this message was deleted or never existed. Please try again or say `cancel` to cancel."]
+
+        # Here we've found the message - it's up to you to decide what to do next!
+        self.state = State.MESSAGE_IDENTIFIED
+        self.message_id = message.id
+        self.channel_id = channel.id
+        return ["I found this message:", "```" + message.author.name + ": " + message.content + "```", \
+                "Help us understand the problem. What's going on with this message? Please type the number of the following reasons: \n1. I am not interested in this message. \n2. It's suspicious or a scam. \n3. It's abusive or harmful. \n4. It's misleading. \n5. It expresses intentions of self-harm or suicide."]
 
     def report_complete(self):
         return self.state == State.REPORT_COMPLETE
-    
-
-
-    
 
+    def idle_time(self):
+        '''
+        Return how many seconds have passed since the user last sent a message in this report.
+        '''
+        return time.monotonic() - self.last_active
@@ -0,0 +1,356 @@
+import random
+import sqlite3
+import threading
+import time
+
+def increment(delta):
+    '''
+    Return a server value that atomically adds delta to a counter in the Firebase database.
+    '''
+    return {'.sv': {'increment': delta}}
+
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+push_lock = threading.Lock()
+last_push = [0, []] # Time in milliseconds and random digits of the last generated push key
+
+def push_key():
+    '''
+    Generate a Firebase push key on the client, so a new child can be written in the same update as other paths.
+    Keys sort in the order they were generated: 8 characters of timestamp followed by 12 random characters, which
+    are incremented instead of redrawn when two keys are generated in the same millisecond.
+    '''
+    with push_lock:
+        now = int(time.time() * 1000)
+        if now == last_push[0]:
+            digits = last_push[1]
+            i = len(digits) - 1
+            while digits[i] == len(PUSH_CHARS) - 1:
+                digits[i] = 0
+                i -= 1
+            digits[i] += 1
+        else:
+            digits = [random.randrange(len(PUSH_CHARS)) for _ in range(12)]
+        last_push[0], last_push[1] = now, digits
+        timestamp = []
+        for _ in range(8):
+            timestamp.append(PUSH_CHARS[now % 64])
+            now //= 64
+        return ''.join(reversed(timestamp)) + ''.join(PUSH_CHARS[d] for d in digits)
+
+class StorageBackend:
+    '''
+    Interface for the stores behind Database. Backends only read and write; caching and write-behind of counters
+    are handled by Database on top of them.
+    '''
+
+    def create_message_record(self, message_id):
+        raise NotImplementedError
+
+    def add_report(self, message_id, report):
+        '''
+        Atomically append a content reviewer report to the message record and increment its report count.
+        '''
+        raise NotImplementedError
+
+    def add_prompt(self, prompt_id, message_id):
+        raise NotImplementedError
+
+    def get_message_from_prompt(self, prompt_id):
+        raise NotImplementedError
+
+    def remove_prompt(self, prompt_id):
+        raise NotImplementedError
+
+    def add_forward(self, forward_id, message_id, channel_id):
+        raise NotImplementedError
+
+    def get_forward(self, forward_id):
+        '''
+        Return (message ID, channel ID) of the original message for a forwarded report, or None.
+        '''
+        raise NotImplementedError
+
+    def get_cr_reports(self, message_id, limit=None):
+        '''
+        Return the message record as a dictionary with 'cr_reports', 'cr_report_count' and 'non_severe_count',
+        or None if the message has no record. 'cr_reports' is a list of the latest limit reports (all of them if
+        limit is None), oldest first, and 'cr_report_count' is the total number of reports.
+        '''
+        raise NotImplementedError
+
+    def get_not_severe(self, message_id):
+        raise NotImplementedError
+
+    def increment_not_severe(self, deltas, checkpoints=None):
+        '''
+        Given a map from message IDs to increments, atomically add them to the non-severe counts. checkpoints, a
+        map from checkpoint names to message IDs, is saved in the same update.
+        '''
+        raise NotImplementedError
+
+    def get_checkpoint(self, name):
+        '''
+        Return the message ID saved for the named checkpoint, or None.
+        '''
+        raise NotImplementedError
+
+    def get_checkpoints(self, prefix):
+        '''
+        Return a map from the name of every checkpoint starting with prefix to its message ID.
+        '''
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FirebaseBackend(StorageBackend):
+    '''
+    Firebase Realtime Database backend. firebase_admin is only imported when this backend is created.
+    '''
+
+    def __init__(self, credentials_path='firebase-sdk.json', database_url='https://cs-152-group-23-default-rtdb.firebaseio.com/'):
+        import firebase_admin
+        from firebase_admin import credentials
+        from firebase_admin import db
+        cred = credentials.Certificate(credentials_path)
+        firebase_admin.initialize_app(cred, {
+        'databaseURL': database_url
+        })
+        self.db = db
+
+    def create_message_record(self, message_id):
+        ref = self.db.reference('/')
+        ref.update({
+            f'Messages/{message_id}': {
+                'cr_reports': {},
+                'cr_report_count': 0,
+                'non_severe_count': 0
+            },
+        })
+
+    def add_report(self, message_id, report):
+        # One multi-path update with a push key and a server-side increment, so concurrent reports can't
+        # overwrite each other
+        ref = self.db.reference(f'Messages/{message_id}')
+        ref.update({
+            f'cr_reports/{push_key()}': report,
+            'cr_report_count': increment(1)
+        })
+
+    def add_prompt(self, prompt_id, message_id):
+        ref = self.db.reference('/')
+        ref.update({
+            f'Prompts/{prompt_id}': message_id
+        })
+
+    def get_message_from_prompt(self, prompt_id):
+        return self.db.reference(f'Prompts/{prompt_id}').get()
+
+    def remove_prompt(self, prompt_id):
+        self.db.reference(f'Prompts/{prompt_id}').delete()
+
+    def add_forward(self, forward_id, message_id, channel_id):
+        ref = self.db.reference('/')
+        ref.update({
+            f'Forwards/{forward_id}': {
+                'message_id': message_id,
+                'channel_id': channel_id
+            }
+        })
+
+    def get_forward(self, forward_id):
+        forward = self.db.reference(f'Forwards/{forward_id}').get()
+        if forward is None:
+            return None
+        return (forward['message_id'], forward['channel_id'])
+
+    def get_cr_reports(self, message_id, limit=None):
+        # A shallow read fetches the counters without downloading every report
+        record = self.db.reference(f'Messages/{message_id}').get(shallow=True)
+        if record is None:
+            return None
+        query = self.db.reference(f'Messages/{message_id}/cr_reports').order_by_key()
+        if limit is not None:
+            query = query.limit_to_last(limit)
+        # Reports filed before push keys were used are numbered from 1, and sort before the push keys
+        reports = query.get() if record.get('cr_reports') else None
+        return {
+            'cr_reports': [report for report in (reports or {}).values() if report is not None],
+            'cr_report_count': record.get('cr_report_count', 0),
+            'non_severe_count': record.get('non_severe_count', 0),
+        }
+
+    def get_not_severe(self, message_id):
+        non_severe_count = self.db.reference(f'Messages/{message_id}/non_severe_count').get()
+        if non_severe_count == None:
+            return 0
+        return non_severe_count
+
+    def increment_not_severe(self, deltas, checkpoints=None):
+        updates = {f'Messages/{message_id}/non_severe_count': increment(delta) for message_id, delta in deltas.items()}
+        for name, message_id in (checkpoints or {}).items():
+            updates[f'Checkpoints/{name}'] = message_id
+        ref = self.db.reference('/')
+        ref.update(updates)
+
+    def get_checkpoint(self, name):
+        return self.db.reference(f'Checkpoints/{name}').get()
+
+    def get_checkpoints(self, prefix):
+        checkpoints = self.db.reference('Checkpoints').order_by_key().start_at(prefix).end_at(prefix + '\uf8ff').get()
+        return dict(checkpoints or {})
+
+
+class SqliteBackend(StorageBackend):
+    '''
+    Embedded SQLite backend for single-node deployments and offline testing. The database runs in WAL mode so
+    reads don't wait on writes, and each method is a single transaction.
+    '''
+
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS messages (
+        message_id INTEGER PRIMARY KEY,
+        cr_report_count INTEGER NOT NULL DEFAULT 0,
+        non_severe_count INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS cr_reports (
+        message_id INTEGER NOT NULL,
+        report_number INTEGER NOT NULL,
+        author TEXT,
+        time TEXT,
+        description TEXT,
+        PRIMARY KEY (message_id, report_number)
+    );
+    CREATE TABLE IF NOT EXISTS prompts (
+        prompt_id INTEGER PRIMARY KEY,
+        message_id INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS forwards (
+        forward_id INTEGER PRIMARY KEY,
+        message_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        name TEXT PRIMARY KEY,
+        message_id INTEGER NOT NULL
+    );
+    '''
+
+    def __init__(self, path='moderation.db'):
+        # The connection is shared by AsyncDatabase's worker threads, so access is serialized with a lock
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(self.SCHEMA)
+
+    def transaction(self, statements):
+        '''
+        Run a list of (sql, parameters) pairs in one transaction. parameters may be a list of tuples, in which
+        case the statement is executed once per tuple.
+        '''
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                for sql, parameters in statements:
+                    if isinstance(parameters, list):
+                        self.connection.executemany(sql, parameters)
+                    else:
+                        self.connection.execute(sql, parameters)
+                self.connection.execute('COMMIT')
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+
+    def query(self, sql, parameters):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def create_message_record(self, message_id):
+        self.transaction([
+            ('DELETE FROM cr_reports WHERE message_id = ?', (message_id,)),
+            ('INSERT OR REPLACE INTO messages (message_id, cr_report_count, non_severe_count) VALUES (?, 0, 0)', (message_id,)),
+        ])
+
+    def add_report(self, message_id, report):
+        self.transaction([
+            ('INSERT INTO messages (message_id, cr_report_count) VALUES (?, 1) '
+             'ON CONFLICT (message_id) DO UPDATE SET cr_report_count = cr_report_count + 1', (message_id,)),
+            ('INSERT INTO cr_reports (message_id, report_number, author, time, description) '
+             'SELECT ?, cr_report_count, ?, ?, ? FROM messages WHERE message_id = ?',
+             (message_id, report['author'], report['time'], report['description'], message_id)),
+        ])
+
+    def add_prompt(self, prompt_id, message_id):
+        self.transaction([('INSERT OR REPLACE INTO prompts (prompt_id, message_id) VALUES (?, ?)', (prompt_id, message_id))])
+
+    def get_message_from_prompt(self, prompt_id):
+        rows = self.query('SELECT message_id FROM prompts WHERE prompt_id = ?', (prompt_id,))
+        return rows[0][0] if rows else None
+
+    def remove_prompt(self, prompt_id):
+        self.transaction([('DELETE FROM prompts WHERE prompt_id = ?', (prompt_id,))])
+
+    def add_forward(self, forward_id, message_id, channel_id):
+        self.transaction([('INSERT OR REPLACE INTO forwards (forward_id, message_id, channel_id) VALUES (?, ?, ?)',
+                           (forward_id, message_id, channel_id))])
+
+    def get_forward(self, forward_id):
+        rows = self.query('SELECT message_id, channel_id FROM forwards WHERE forward_id = ?', (forward_id,))
+        return tuple(rows[0]) if rows else None
+
+    def get_cr_reports(self, message_id, limit=None):
+        with self.lock:
+            record = self.connection.execute(
+                'SELECT cr_report_count, non_severe_count FROM messages WHERE message_id = ?', (message_id,)).fetchone()
+            if record is None:
+                return None
+            # Newest first so LIMIT keeps the latest reports, then put back in order
+            reports = self.connection.execute(
+                'SELECT author, time, description FROM cr_reports WHERE message_id = ? ORDER BY report_number DESC LIMIT ?',
+                (message_id, -1 if limit is None else limit)).fetchall()
+        return {
+            'cr_reports': [{'author': author, 'time': time, 'description': description} for author, time, description in reversed(reports)],
+            'cr_report_count': record[0],
+            'non_severe_count': record[1],
+        }
+
+    def get_not_severe(self, message_id):
+        rows = self.query('SELECT non_severe_count FROM messages WHERE message_id = ?', (message_id,))
+        return rows[0][0] if rows else 0
+
+    def increment_not_severe(self, deltas, checkpoints=None):
+        statements = [
+            ('INSERT INTO messages (message_id, non_severe_count) VALUES (?, ?) '
+             'ON CONFLICT (message_id) DO UPDATE SET non_severe_count = non_severe_count + excluded.non_severe_count',
+             list(deltas.items())),
+        ]
+        if checkpoints:
+            statements.append(('INSERT OR REPLACE INTO checkpoints (name, message_id) VALUES (?, ?)', list(checkpoints.items())))
+        self.transaction(statements)
+
+    def get_checkpoint(self, name):
+        rows = self.query('SELECT message_id FROM checkpoints WHERE name = ?', (name,))
+        return rows[0][0] if rows else None
+
+    def get_checkpoints(self, prefix):
+        return dict(self.query('SELECT name, message_id FROM checkpoints WHERE substr(name, 1, ?) = ?', (len(prefix), prefix)))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+BACKENDS = {
+    'firebase': FirebaseBackend,
+    'sqlite': SqliteBackend,
+}
+
+def create_backend(name, **options):
+    '''
+    Given the name of a backend ('firebase' or 'sqlite') and its constructor options, create it.
+    '''
+    if name not in BACKENDS:
+        raise Exception(f"Unknown storage backend {name!r}. Choose one of: {', '.join(BACKENDS)}.")
+    return BACKENDS[name](**options)
@@ -0,0 +1,39 @@
+import asyncio
+from types import SimpleNamespace
+
+from backfill import Backfill, uncovered
+from database import AsyncDatabase, Database
+from storage import create_backend
+
+class FakeChannel:
+    def __init__(self, message_ids):
+        self.id = 1
+        self.messages = [SimpleNamespace(id=message_id) for message_id in message_ids]
+
+    async def history(self, limit=None, after=None, before=None, oldest_first=True):
+        for message in self.messages:
+            if (after is None or message.id > after.id) and (before is None or message.id < before.id):
+                yield message
+
+def test_uncovered_skips_live_ranges():
+    assert uncovered(None, 100, []) == [(None, 100)]
+    assert uncovered(5, 100, [(20, 30), (25, 40), (90, 120)]) == [(5, 20), (40, 90)]
+    assert uncovered(50, 100, [(10, 60)]) == [(60, 100)]
+
+def test_backfill_skips_messages_counted_live_before_a_restart():
+    async def scenario():
+        db = AsyncDatabase(Database(create_backend('sqlite', path=':memory:')))
+        channel = FakeChannel(range(100, 2100, 100))
+        # The first run counted messages live from 1000 until it stopped after 1400
+        for message_id in range(1000, 1500, 100):
+            await db.add_not_severe(message_id, (Backfill.live_checkpoint_name(channel.id, 1000), message_id))
+        # The next run counts live from 1800, so the backfill scans up to there
+        backfill = Backfill(lambda batch: [True] * len(batch), db, batch_size=3)
+        scanned, flagged = await backfill.run(channel, before=1800)
+        counts = {message.id: await db.get_not_severe(message.id) for message in channel.messages}
+        await db.close()
+        return scanned, counts
+    scanned, counts = asyncio.run(scenario())
+    assert scanned == 12
+    assert all(counts[message_id] == 1 for message_id in range(100, 1800, 100))
+    assert all(counts[message_id] == 0 for message_id in range(1800, 2100, 100))
@@ -0,0 +1,26 @@
+from addresses import extract_addresses
+from blacklist import Blacklist
+
+# Listed without the 0x prefix on line 21 of blacklist.txt
+BARE_ETH = '9f4cda013e354b8fc285bf4b9a60460cee7f7ea9'
+
+def test_bare_eth_address_is_caught():
+    blacklist = Blacklist('blacklist.txt')
+    assert blacklist.find_addresses(extract_addresses(f'send it to {BARE_ETH} now')) is not None
+
+def test_prefixed_eth_address_matches_bare_entry():
+    blacklist = Blacklist('blacklist.txt')
+    assert blacklist.find_addresses(extract_addresses(f'send it to 0x{BARE_ETH} now')) is not None
+
+def test_hex_inside_longer_run_is_ignored():
+    assert extract_addresses(f'{BARE_ETH}ff') == []
+
+def test_reconverting_keeps_mapped_blacklist_readable(tmp_path):
+    from compact_blacklist import CompactBlacklist, convert
+    path = str(tmp_path / 'blacklist.bin')
+    convert('blacklist.txt', path)
+    mapped = CompactBlacklist(path)
+    (tmp_path / 'other.txt').write_text('0xabc\n')
+    convert(str(tmp_path / 'other.txt'), path)
+    assert mapped.get(BARE_ETH) is not None
+    assert CompactBlacklist(path).get(BARE_ETH) is None
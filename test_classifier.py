@@ -0,0 +1,7 @@
+from classifier import ScamClassifier
+
+def test_bare_sha1_is_not_a_scam():
+    assert not ScamClassifier().classify('fixed in commit 223dda9145369b1a610f6307209b395b71b40ec5, please pull')
+
+def test_prefixed_eth_address_is_flagged():
+    assert ScamClassifier().classify('send it to 0x9f4cda013e354b8fc285bf4b9a60460cee7f7ea9')
@@ -0,0 +1,29 @@
+import threading
+
+from database import Database
+from storage import create_backend
+
+def test_read_overtaken_by_flush_is_not_cached():
+    db = Database(create_backend('sqlite', path=':memory:'), write_behind=True, flush_interval=3600)
+    db.create_message_record(1)
+    db.add_not_severe(1)
+    read_started, release_read = threading.Event(), threading.Event()
+    get_not_severe = db.backend.get_not_severe
+    def slow_get_not_severe(message_id):
+        count = get_not_severe(message_id)
+        db.backend.get_not_severe = get_not_severe
+        read_started.set()
+        release_read.wait()
+        return count
+    db.backend.get_not_severe = slow_get_not_severe
+    counts = []
+    reader = threading.Thread(target=lambda: counts.append(db.get_not_severe(1)))
+    reader.start()
+    read_started.wait()
+    # The flush writes the increment while the read that started before it is still in progress
+    db.flush()
+    release_read.set()
+    reader.join()
+    assert counts == [1]
+    assert db.get_not_severe(1) == 1
+    db.close()
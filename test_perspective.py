@@ -0,0 +1,41 @@
+import asyncio
+
+from aiohttp.test_utils import TestServer
+
+from perspective import PerspectiveClient
+from perspective_stub import PerspectiveStub
+
+async def scored(stub, texts_by_round):
+    '''
+    Serve the stub on a local port and score each round of texts with one client, returning the client and the
+    scores of every round.
+    '''
+    server = TestServer(stub.app())
+    await server.start_server()
+    client = PerspectiveClient('key', url=str(server.make_url('/v1alpha1/comments:analyze')), batch_window=0.01)
+    try:
+        return client, [await client.score_batch(texts) for texts in texts_by_round]
+    finally:
+        await client.close()
+        await server.close()
+
+def test_duplicates_in_a_batch_are_scored_once():
+    stub = PerspectiveStub()
+    client, [scores] = asyncio.run(scored(stub, [['free nitro', 'hello', 'free nitro', 'free nitro']]))
+    assert stub.requests == 2
+    assert scores[0] == scores[2] == scores[3]
+    assert scores[0] != scores[1]
+
+def test_repeated_text_is_a_cache_hit():
+    stub = PerspectiveStub()
+    client, [first, second] = asyncio.run(scored(stub, [['hello'], ['hello']]))
+    assert stub.requests == 1
+    assert first == second
+    assert client.cache.stats()['hits'] == 1
+
+def test_rate_limited_text_is_none_and_not_cached():
+    stub = PerspectiveStub(error_rate=1.0)
+    client, [first, second] = asyncio.run(scored(stub, [['hello'], ['hello']]))
+    assert first == second == [None]
+    assert stub.rate_limited == stub.requests == 2
+    assert client.failures == 2